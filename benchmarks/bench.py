@@ -0,0 +1,204 @@
+# -*- coding: UTF-8 -*-
+"""Scaling benchmarks for PivotTable.
+
+Every case pivots synthetic rows built from five parameters: the number of
+rows, of distinct keys, of xaxis values and of metrics, and the formatter
+applied to the cells. Starting from a base case, every sweep changes one of
+them. For every case the time of headers and result (on a fresh table, best
+of --repeat runs) and the peak memory traced by tracemalloc (on another run,
+since tracing slows everything down) are reported.
+
+    python benchmarks/bench.py                        # run every sweep
+    python benchmarks/bench.py --quick                # smaller sizes
+    python benchmarks/bench.py --save baseline.json   # store a baseline
+    python benchmarks/bench.py --compare baseline.json
+
+With --compare, cases slower (or using more memory) than the baseline by more
+than --threshold are reported and the exit status is 1.
+"""
+import gc
+import json
+import os
+import random
+import sys
+import time
+from optparse import OptionParser
+try:
+    import tracemalloc
+except ImportError: # python < 3.4
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from pivottable import PivotTable, GroupBy, Sum, Mean, Count, Max
+
+try:
+    timer = time.perf_counter
+except AttributeError: # python < 3.3
+    timer = time.time
+
+class Row(object):
+    """A synthetic row"""
+    __slots__ = ('region', 'key', 'period', 'm0', 'm1', 'm2', 'm3', 'm4',
+                 'm5', 'm6', 'm7')
+
+AGGREGATIONS = [Sum, Mean, Count, Max]
+
+FORMATTERS = {
+    'none': None,
+    'str': str,
+    'fixed': lambda v: '%.2f' % v,
+    # what locale aware number formatting costs
+    'grouped': lambda v: '{:,.2f}'.format(v).replace(',', ' ').replace(
+        '.', ',')
+}
+
+BASE = {'rows':20000, 'keys':1000, 'xvalues':12, 'metrics':2,
+        'formatter':'str'}
+
+SWEEPS = [
+    ('rows', [5000, 20000, 100000, 400000]),
+    ('keys', [10, 1000, 10000, 20000]),
+    ('xvalues', [4, 12, 100, 1000]),
+    ('metrics', [1, 2, 4, 8]),
+    ('formatter', ['none', 'str', 'fixed', 'grouped']),
+]
+
+QUICK_SWEEPS = [
+    ('rows', [2000, 20000]),
+    ('keys', [10, 5000]),
+    ('xvalues', [4, 200]),
+    ('metrics', [1, 4]),
+    ('formatter', ['none', 'grouped']),
+]
+
+def make_rows(rows, keys, xvalues, metrics, seed=0):
+    """rows synthetic rows spread over keys distinct (region, key) pairs and
+    xvalues periods, with metrics numeric attributes"""
+    rnd = random.Random(seed)
+    regions = max(1, keys // 100)
+    data = []
+    for i in range(rows):
+        r = Row()
+        k = rnd.randrange(keys)
+        r.region = 'region %03d' % (k % regions)
+        r.key = k
+        r.period = rnd.randrange(xvalues)
+        for m in range(metrics):
+            setattr(r, 'm%d' % m, rnd.random()*1000)
+        data.append(r)
+    return data
+
+def make_table(data, metrics, formatter):
+    yaxis = [{'attr':'region', 'label':'Region', 'aggr':GroupBy},
+             {'attr':'key', 'label':'Key', 'aggr':GroupBy}]
+    for m in range(metrics):
+        y = {'attr':'m%d' % m, 'label':'Metric %d' % m,
+             'aggr':AGGREGATIONS[m % len(AGGREGATIONS)]}
+        if FORMATTERS[formatter] is not None:
+            y['format'] = FORMATTERS[formatter]
+        yaxis.append(y)
+    return PivotTable(rows=data, xaxis='period', yaxis=yaxis,
+                      yaxis_order=['region', 'key'])
+
+def measure(case, repeat):
+    """Time and peak memory of headers and result for case"""
+    data = make_rows(case['rows'], case['keys'], case['xvalues'],
+                     case['metrics'])
+    out = {}
+    for name, read in (('headers', lambda t: t.headers),
+                       ('result', lambda t: list(t.result))):
+        best = None
+        for i in range(repeat):
+            table = make_table(data, case['metrics'], case['formatter'])
+            gc.collect()
+            start = timer()
+            read(table)
+            elapsed = timer() - start
+            if best is None or elapsed<best:
+                best = elapsed
+        out[name + '_s'] = best
+        if tracemalloc is not None:
+            table = make_table(data, case['metrics'], case['formatter'])
+            gc.collect()
+            tracemalloc.start()
+            read(table)
+            out[name + '_peak_kb'] = tracemalloc.get_traced_memory()[1]//1024
+            tracemalloc.stop()
+    return out
+
+def case_name(case):
+    return ' '.join('%s=%s' % (k, case[k]) for k in sorted(case))
+
+def run(sweeps, repeat):
+    results = {}
+    for param, values in sweeps:
+        for value in values:
+            case = dict(BASE)
+            case[param] = value
+            name = case_name(case)
+            if name in results:
+                continue
+            results[name] = measure(case, repeat)
+            report(name, results[name])
+    return results
+
+def report(name, r):
+    line = '%-70s headers %8.3fs  result %8.3fs' % (name, r['headers_s'],
+                                                   r['result_s'])
+    if 'result_peak_kb' in r:
+        line += '  peak %8d KB' % r['result_peak_kb']
+    print(line)
+    sys.stdout.flush()
+
+def compare(results, baseline, threshold):
+    """Print the cases of results that are worse than in baseline by more
+    than threshold and return how many there are"""
+    regressions = 0
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for metric, value in sorted(results[name].items()):
+            old = baseline[name].get(metric)
+            # ignore noise in very short measures
+            if not old or (metric.endswith('_s') and value<0.01):
+                continue
+            if value>old*threshold:
+                regressions += 1
+                print('REGRESSION %s %s: %.3f -> %.3f (x%.2f)' %
+                      (name, metric, old, value, value/old))
+    return regressions
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--quick', action='store_true', default=False,
+                      help='smaller sweeps')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='timed runs of every case (the best is kept)')
+    parser.add_option('--save', metavar='FILE',
+                      help='store the results as a baseline')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare the results with a baseline')
+    parser.add_option('--threshold', type='float', default=1.25,
+                      help='ratio over the baseline reported as a '
+                           'regression (default: 1.25)')
+    options = parser.parse_args(argv)[0]
+    results = run(options.quick and QUICK_SWEEPS or SWEEPS, options.repeat)
+    if options.save:
+        f = open(options.save, 'w')
+        try:
+            json.dump(results, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+    if options.compare:
+        f = open(options.compare)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        if compare(results, baseline, options.threshold):
+            return 1
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main())
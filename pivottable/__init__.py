@@ -1,3 +1,6 @@
 from .pivottable import (
-    PivotTable, GroupBy, Sum
+    PivotTable, PivotSpec, PivotTableError, pivot_many, Rows, Stream,
+    SparseResult, SparseRow, PivotStats, Range, In, Aggregation, GroupBy,
+    Count, Sum, Mean, Min, Max
 )
+from .storage import load_result, StoredResult
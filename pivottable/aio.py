@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+"""asyncio support (python 3.6 or newer, so it is not imported by the package).
+
+aggregate consumes the rows of a PivotTable from an async iterable (an async
+DB cursor, a generator that reads pages over HTTP, etc) as they arrive, and
+aiter_result yields the rows of its result. Both hand control back to the
+event loop every chunksize rows, so a large pivot does not block other tasks:
+
+    table = PivotTable(xaxis='month', yaxis=yaxis, yaxis_order=['city'])
+    await aggregate(table, fetch_sales())
+    async for row in aiter_result(table):
+        ...
+"""
+import asyncio
+from itertools import islice
+
+from .pivottable import PivotTableError, _Aggregated, _access
+
+__all__ = ['AsyncStream', 'aggregate', 'aiter_result']
+
+class AsyncStream(object):
+    """One-shot rows read from an async iterable (or a plain one). Like a
+    Stream, every row is consumed once and only the aggregated cells are kept.
+    The rows can only be read by aggregate: reading headers or result before
+    raises a PivotTableError, and so does changing the pivot definition
+    afterwards"""
+
+    generation = 0
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.consumed = False
+        self._access = None
+
+    def has_attr(self, name):
+        # it cannot be checked without consuming the rows
+        return True
+
+    def access(self):
+        """How the attributes of the rows are read (see PivotSpec), known once
+        the first chunk was read"""
+        return self._access or 'attr'
+
+    async def chunks(self, chunksize):
+        """Yield lists of up to chunksize rows"""
+        async for chunk in self._chunks(chunksize):
+            if self._access is None:
+                self._access = _access(chunk[0])
+            yield chunk
+
+    async def _chunks(self, chunksize):
+        if self.consumed:
+            raise PivotTableError("The rows were already consumed")
+        self.consumed = True
+        if hasattr(self.iterable, '__aiter__'):
+            chunk = []
+            async for row in self.iterable:
+                chunk.append(row)
+                if len(chunk)==chunksize:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        else:
+            rows = iter(self.iterable)
+            chunk = list(islice(rows, chunksize))
+            while chunk:
+                yield chunk
+                chunk = list(islice(rows, chunksize))
+
+    def aggregate(self, c, spec):
+        if self.consumed:
+            raise PivotTableError("The rows were already consumed")
+        raise PivotTableError("Async rows must be read with "
+                              "pivottable.aio.aggregate")
+
+async def aggregate(table, rows=None, chunksize=1000):
+    """Aggregate the rows of table, a PivotTable, a chunk at a time, giving
+    control back to the event loop after every chunk of chunksize rows. rows,
+    if given, is assigned to table.rows as an AsyncStream; otherwise table.rows
+    must already be one. Afterwards headers and result are read from the
+    cache without reading any row. Rows are aggregated in the thread of the
+    event loop: workers is ignored, memory_limit and where apply"""
+    if rows is not None:
+        table.rows = AsyncStream(rows)
+    stream = table.rows
+    if not isinstance(stream, AsyncStream):
+        raise PivotTableError("The rows of the table are not an AsyncStream")
+    spec = None
+    async for chunk in stream.chunks(chunksize):
+        if spec is None:
+            # the first rows tell how to read them
+            spec = table.spec
+            c = _Aggregated(spec.sig, stream)
+        with spec._phase('aggregate'):
+            new_keys = spec._feed(c, chunk)
+            if spec.memory_limit:
+                spec._check_budget(c)
+            elif new_keys:
+                with spec._phase('sort'):
+                    spec._add_keys(c, new_keys)
+        await asyncio.sleep(0)
+    if spec is None:
+        spec = table.spec
+        c = _Aggregated(spec.sig, stream)
+    if spec.memory_limit:
+        with spec._phase('sort'):
+            c.keys = sorted(c.groups)
+    c.complete = True
+    if spec.stats is not None:
+        spec.stats.rows = c.seen
+    with table._lock:
+        table._cache = c
+        # fills in the rest of the stats
+        table._sync(spec)
+    if spec.stats is not None:
+        table._report(spec.stats)
+
+async def aiter_result(table, raw=False, chunksize=1000):
+    """Yield the rows of table.result (or table.raw_result if raw is True),
+    header rows first, building them as they are requested and giving control
+    back to the event loop every chunksize rows"""
+    spec = table.spec
+    with table._lock:
+        c = table._sync(spec)
+    n = 0
+    for kind, row in spec.iter_rows(c, raw):
+        yield row
+        n += 1
+        if n==chunksize:
+            n = 0
+            await asyncio.sleep(0)
+    if spec.stats is not None:
+        table._report(spec.stats)
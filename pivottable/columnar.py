@@ -0,0 +1,314 @@
+# -*- coding: UTF-8 -*-
+"""Columnar rows for PivotTable.
+
+When the data is already stored by column (a NumPy structured array or a dict
+of equal length arrays) there is no need to build one object per row: keys and
+xaxis values are factorized with np.unique and the built in aggregations are
+computed with bincount and ufunc.at over the whole columns. The reduced
+columns are kept as they are: the Aggregation of a cell is only built when it
+is read (to render or add up the cell), so the cost of the aggregation does
+not grow with the number of cells.
+"""
+try:
+    import numpy as np
+except ImportError: # numpy is optional
+    np = None
+
+from .pivottable import (
+    PivotTableError, Count, Sum, Mean, Min, Max, Range, In, _ORDERS
+)
+
+__all__ = ['Columns']
+
+class Columns(object):
+    """Rows stored by column. Accepts a NumPy structured array or a dict that
+    maps every attribute name to an array (or any sequence numpy can convert)
+    of the same length. Columns are considered immutable: call
+    PivotTable.invalidate if the arrays are modified in place"""
+
+    generation = 0
+
+    def __init__(self, data):
+        if np is None:
+            raise PivotTableError("numpy is required for columnar rows")
+        if isinstance(data, dict):
+            columns = dict((k, np.asarray(v)) for k, v in data.items())
+        else:
+            names = getattr(getattr(data, 'dtype', None), 'names', None)
+            if not names:
+                raise PivotTableError("Columnar rows must be a structured "
+                                      "array or a dict of arrays")
+            columns = dict((n, data[n]) for n in names)
+        lengths = set(len(v) for v in columns.values())
+        if len(lengths)>1:
+            raise PivotTableError("All columns must have the same length")
+        self.columns = columns
+        self._len = lengths and lengths.pop() or 0
+
+    def __len__(self):
+        return self._len
+
+    def has_attr(self, name):
+        return name in self.columns
+
+    def column(self, name):
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise PivotTableError("Unknown column: %s" % name)
+
+    def aggregate(self, c, spec):
+        """Aggregate every row in one go and fill the groups, keys and xvalues
+        of c for the PivotSpec spec"""
+        mask = self.mask(spec.where)
+        if mask is None:
+            column = self.column
+            n = len(self)
+        else:
+            # the rows that do not match the where of spec are dropped from
+            # every column before anything else
+            column = lambda name: self.column(name)[mask]
+            n = int(mask.sum())
+        keys, kinv = _factorize_keys([column(a) for a in
+                                      spec.yaxis_order], n)
+        xvalues, xinv = _factorize_keys([column(a) for a in
+                                         spec.xaxis_attrs], n)
+        nx = len(xvalues)
+        cell = kinv.astype(np.int64)*nx + xinv
+        dense = len(keys)*nx
+        if dense<=4*n:
+            # few enough combinations: work on the whole key x xaxis grid
+            cinv = cell
+            ucell = np.flatnonzero(np.bincount(cell, minlength=dense))
+            ncells = dense
+            populated = ucell
+        else:
+            # the reduced columns only hold the cells of ucell
+            ucell, cinv = np.unique(cell, return_inverse=True)
+            cinv = cinv.reshape(-1)
+            ncells = len(ucell)
+            populated = np.arange(ncells)
+        # one callable per metric that builds the aggregation of the cell
+        # at a position of ucell
+        builders = []
+        for aggr, attr in zip(spec.aggrs, spec.attrs):
+            values = column(attr)
+            reducer = _reducers.get(aggr)
+            if reducer is not None and values.dtype.kind in 'biuf':
+                builders.append(reducer(values, cinv, ncells, populated))
+            else:
+                builders.append(_generic(aggr, values, cinv, ncells,
+                                         populated).__getitem__)
+        builders = tuple(builders)
+        groups = c.groups
+        kidx = (ucell // nx).tolist()
+        xidx = (ucell % nx).tolist()
+        for i in range(len(kidx)):
+            k = keys[kidx[i]]
+            try:
+                g = groups[k]
+            except KeyError:
+                g = groups[k] = {}
+            g[xvalues[xidx[i]]] = _Cell(builders, i)
+        if _ORDERS.get(spec.xaxis_sort)=='insertion':
+            # insertion order needs the xaxis values in the order of their
+            # first row
+            xvalues = _first_seen(xvalues, xinv, n)
+        for x in xvalues:
+            c.xvalues[x] = None
+        c.sorted_xvalues = None
+        if _ORDERS.get(spec.yaxis_sort)=='sorted':
+            c.keys = sorted(groups)
+        else:
+            spec._add_keys(c, _first_seen(keys, kinv, n))
+        c.seen = len(self)
+        c.complete = True
+
+    def mask(self, where):
+        """A boolean array of the rows that match where (a sequence of (attr,
+        condition) pairs, see PivotSpec), or None if there are no conditions"""
+        mask = None
+        for attr, cond in where:
+            values = self.column(attr)
+            if isinstance(cond, Range):
+                m = np.ones(len(values), dtype=bool)
+                if cond.low is not None:
+                    m &= values>=cond.low
+                if cond.high is not None:
+                    m &= values<=cond.high
+            elif isinstance(cond, In):
+                m = np.isin(values, list(cond.values))
+            else:
+                m = values==cond.value
+            if mask is None:
+                mask = m
+            else:
+                mask &= m
+        return mask
+
+def _unique(values):
+    """np.unique(values, return_inverse=True) without sorting the whole column
+    when values are integers in a small enough range"""
+    if values.dtype.kind in 'iu' and len(values):
+        low, high = int(values.min()), int(values.max())
+        if high-low<=4*len(values):
+            offset = values.astype(np.int64) - low
+            present = np.bincount(offset, minlength=high-low+1)>0
+            position = np.cumsum(present) - 1
+            return np.flatnonzero(present) + low, position[offset]
+    u, inv = np.unique(values, return_inverse=True)
+    return u, inv.reshape(-1)
+
+def _first_seen(values, inv, n):
+    """values (the distinct values of a factorization) in the order of the
+    first of the n rows whose index in them is in inv"""
+    first = np.full(len(values), n, dtype=np.int64)
+    np.minimum.at(first, inv, np.arange(n))
+    return [values[i] for i in np.argsort(first, kind='stable')]
+
+def _factorize_keys(columns, n):
+    """Return the distinct keys (shaped like the ones attrgetter would build
+    for the same attributes) and the index of every row in them. Used for
+    the xaxis values too"""
+    if not columns:
+        return [()], np.zeros(n, dtype=np.int64)
+    uniques = []
+    code = np.zeros(n, dtype=np.int64)
+    for col in columns:
+        u, inv = _unique(col)
+        uniques.append(u)
+        code = code*len(u) + inv
+    if len(columns)==1:
+        return uniques[0].tolist(), code
+    ucode, kinv = _unique(code)
+    parts = []
+    for u in reversed(uniques):
+        parts.append(u[ucode % len(u)].tolist())
+        ucode = ucode // len(u)
+    parts.reverse()
+    return list(zip(*parts)), kinv
+
+def _present(values):
+    """Mask of the values that are not missing (NaN for floats)"""
+    if values.dtype.kind=='f':
+        return ~np.isnan(values)
+    return None
+
+def _counts(present, cinv, ncells):
+    if present is None:
+        return np.bincount(cinv, minlength=ncells)
+    return np.bincount(cinv[present], minlength=ncells)
+
+def _totals(values, present, cinv, ncells):
+    if present is not None:
+        values = values[present]
+        cinv = cinv[present]
+    if values.dtype.kind=='f':
+        return np.bincount(cinv, weights=values, minlength=ncells)
+    # keep integers exact: bincount would convert them to float
+    totals = np.zeros(ncells, dtype=np.int64)
+    np.add.at(totals, cinv, values)
+    return totals
+
+def _extreme(ufunc, start, values, cinv, ncells):
+    present = _present(values)
+    if present is not None:
+        values = values[present]
+        cinv = cinv[present]
+    if values.dtype.kind=='f':
+        out = np.full(ncells, start, dtype=values.dtype)
+    else:
+        values = values.astype(np.int64)
+        info = np.iinfo(np.int64)
+        out = np.full(ncells, start>0 and info.max or info.min,
+                      dtype=np.int64)
+    ufunc.at(out, cinv, values)
+    return out
+
+class _Cell(object):
+    """The aggregations of a cell (one per metric, like the lists the other
+    row sources build), created from the reduced columns every time they are
+    read"""
+    __slots__ = ('builders', 'position')
+
+    def __init__(self, builders, position):
+        self.builders = builders
+        self.position = position
+
+    def __len__(self):
+        return len(self.builders)
+
+    def __getitem__(self, i):
+        return self.builders[i](self.position)
+
+    def __iter__(self):
+        for build in self.builders:
+            yield build(self.position)
+
+def _build(aggr, populated, counts, **state):
+    """A callable that returns the instance of aggr of the cell at a position
+    of populated (the indexes of the populated cells in the reduced columns),
+    with the given state attributes. Cells that received no values keep the
+    initial state"""
+    names = list(state)
+    values = [state[k][populated].tolist() for k in names]
+    counts = counts[populated].tolist()
+    new = object.__new__
+    if len(names)==1:
+        # the common case, without the zip
+        name, column = names[0], values[0]
+        def build(i):
+            if not counts[i]:
+                return aggr()
+            a = new(aggr)
+            a.__dict__ = {name: column[i]}
+            return a
+        return build
+    def build(i):
+        if not counts[i]:
+            return aggr()
+        a = new(aggr)
+        a.__dict__ = dict(zip(names, [v[i] for v in values]))
+        return a
+    return build
+
+def _count(values, cinv, ncells, populated):
+    counts = _counts(_present(values), cinv, ncells)
+    return _build(Count, populated, counts, count=counts)
+
+def _sum(values, cinv, ncells, populated):
+    present = _present(values)
+    counts = _counts(present, cinv, ncells)
+    return _build(Sum, populated, counts,
+                  total=_totals(values, present, cinv, ncells))
+
+def _mean(values, cinv, ncells, populated):
+    present = _present(values)
+    counts = _counts(present, cinv, ncells)
+    return _build(Mean, populated, counts, count=counts,
+                  total=_totals(values, present, cinv, ncells))
+
+def _min(values, cinv, ncells, populated):
+    counts = _counts(_present(values), cinv, ncells)
+    return _build(Min, populated, counts,
+                  value=_extreme(np.minimum, np.inf, values, cinv, ncells))
+
+def _max(values, cinv, ncells, populated):
+    counts = _counts(_present(values), cinv, ncells)
+    return _build(Max, populated, counts,
+                  value=_extreme(np.maximum, -np.inf, values, cinv, ncells))
+
+def _generic(aggr, values, cinv, ncells, populated):
+    """Any other aggregation (or non numeric values): feed the values one by
+    one to an instance per cell"""
+    position = np.full(ncells, -1, dtype=np.int64)
+    position[populated] = np.arange(len(populated))
+    aggrs = [aggr() for i in range(len(populated))]
+    nan = values.dtype.kind=='f'
+    for i, v in zip(position[cinv].tolist(), values.tolist()):
+        if nan and v!=v:
+            v = None
+        aggrs[i].append(v)
+    return aggrs
+
+_reducers = {Count:_count, Sum:_sum, Mean:_mean, Min:_min, Max:_max}
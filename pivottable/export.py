@@ -0,0 +1,144 @@
+# -*- coding: UTF-8 -*-
+"""Exporters for pivot results.
+
+Every exporter reads the rows of a result one at a time and writes them to any
+file-like object in chunks of a given number of rows, so a table is never
+held in memory twice (once as rows and once as text). Pass a PivotTable to
+know the kind of every row (subtotal and total rows can be styled in HTML, and
+every header row of a composite xaxis is recognized), or any iterable of rows
+that starts with its header rows (PivotTable.result, a StoredResult, etc):
+pass nheaders when there is more than one (a StoredResult tells it itself).
+"""
+import csv
+import json
+try:
+    from io import StringIO
+except ImportError: # python 2
+    from StringIO import StringIO
+try:
+    from html import escape
+except ImportError: # python 2
+    from cgi import escape
+
+from .pivottable import PivotTableError
+
+__all__ = ['write_csv', 'write_jsonl', 'write_html']
+
+def _rows(source, nheaders=None):
+    """(kind, row) for every row of source, header rows included"""
+    if hasattr(source, 'iter_rows'):
+        return source.iter_rows()
+    if nheaders is None:
+        nheaders = len(getattr(source, 'header_rows', ())) or 1
+    return _guess_kinds(source, nheaders)
+
+def _guess_kinds(rows, nheaders):
+    for n, row in enumerate(rows):
+        if n<nheaders:
+            yield 'header', row
+        else:
+            yield 'row', row
+
+def _record_keys(header_rows, separator):
+    """The key of every column in records: the values of all its header rows
+    (the ones that are not empty) joined by separator"""
+    keys = []
+    for column in zip(*header_rows):
+        keys.append(separator.join('%s' % v for v in column if v is not None))
+    if len(set(keys))<len(keys):
+        raise PivotTableError("The columns cannot be told apart in records, "
+                              "try another separator")
+    return keys
+
+def write_csv(source, f, chunksize=1000, nheaders=None, **fmtparams):
+    """Write source as CSV to f. fmtparams are handed to csv.writer"""
+    buf = StringIO()
+    writer = csv.writer(buf, **fmtparams)
+    n = 0
+    for kind, row in _rows(source, nheaders):
+        writer.writerow(row)
+        n += 1
+        if n==chunksize:
+            f.write(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+            n = 0
+    f.write(buf.getvalue())
+
+def write_jsonl(source, f, chunksize=1000, records=False, nheaders=None,
+                separator='/'):
+    """Write source as JSON Lines to f: the header rows and then every row
+    as an array or, if records is True, every row as an object with no header
+    lines. The key of every column is its header or, when there are several
+    header rows (a composite xaxis or series), the values of all of them
+    joined by separator (e.g. '2010/North'). Values JSON cannot encode are
+    written as strings"""
+    buf = []
+    dumps = json.dumps
+    header_rows = []
+    keys = None
+    for kind, row in _rows(source, nheaders):
+        if kind=='header':
+            header_rows.append(row)
+            if records:
+                continue
+        elif records:
+            if keys is None:
+                keys = _record_keys(header_rows, separator)
+            row = dict(zip(keys, row))
+        buf.append(dumps(row, default=str))
+        if len(buf)==chunksize:
+            buf.append('')
+            f.write('\n'.join(buf))
+            buf = []
+    if buf:
+        buf.append('')
+        f.write('\n'.join(buf))
+
+# the CSS class of the rows of every kind
+ROW_CLASSES = {'subtotal':'subtotal', 'total':'total'}
+
+def write_html(source, f, chunksize=1000, table_class=None,
+               row_class=ROW_CLASSES, nheaders=None):
+    """Write source as an HTML table to f. table_class is the CSS class of the
+    table. row_class sets the CSS class of every body row: either a dict of
+    row kind ('row', 'subtotal' or 'total') to class or a callable that takes
+    the kind and the row and returns the class (or None for no class)"""
+    if callable(row_class):
+        classify = row_class
+    else:
+        classify = lambda kind, row: row_class.get(kind)
+    buf = []
+    if table_class:
+        buf.append('<table class="%s">\n' % escape(table_class, True))
+    else:
+        buf.append('<table>\n')
+    buf.append('<thead>\n')
+    body = False
+    for kind, row in _rows(source, nheaders):
+        if kind=='header':
+            buf.append('<tr>%s</tr>\n' %
+                       ''.join('<th>%s</th>' % _cell(v) for v in row))
+            continue
+        if not body:
+            buf.append('</thead>\n<tbody>\n')
+            body = True
+        css = classify(kind, row)
+        if css:
+            buf.append('<tr class="%s">' % escape(css, True))
+        else:
+            buf.append('<tr>')
+        buf.append(''.join('<td>%s</td>' % _cell(v) for v in row))
+        buf.append('</tr>\n')
+        if len(buf)>=3*chunksize:
+            f.write(''.join(buf))
+            buf = []
+    if not body:
+        buf.append('</thead>\n<tbody>\n')
+    buf.append('</tbody>\n</table>\n')
+    f.write(''.join(buf))
+
+def _cell(value):
+    if value is None:
+        return ''
+    return escape(str(value))
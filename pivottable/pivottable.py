@@ -1,4 +1,5 @@
 # -*- coding: UTF-8 -*-
+from __future__ import division
 try:
     from collections import OrderedDict # we are in python < 2.7
 except ImportError:
@@ -40,6 +41,36 @@ def o_itemgetter(*items):
             return tuple(obj[item] for item in items)
     return g
 
+try:
+    from concurrent.futures import (
+        ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+    )
+except ImportError: # python < 3.2 without the futures backport
+    ProcessPoolExecutor = ThreadPoolExecutor = as_completed = None
+
+import threading
+
+from collections import deque
+try:
+    from collections.abc import Mapping
+except ImportError: # python 2
+    from collections import Mapping
+from itertools import islice, chain
+from heapq import merge as heap_merge, nlargest, nsmallest
+from tempfile import TemporaryFile
+import sys
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from time import perf_counter as timer
+except ImportError: # python < 3.3
+    from time import time as timer
+try:
+    from functools import lru_cache
+except ImportError: # python < 3.2
+    lru_cache = None
 from sys import version_info
 if version_info<(2,5): 
     def all(iterable):
@@ -54,17 +85,32 @@ else:
 
 
 
-__all__ = ['PivotTable', 'Agregation', 'GroupBy', 'Sum']
+__all__ = ['PivotTable', 'PivotSpec', 'pivot_many', 'Rows', 'Stream',
+           'SparseResult', 'SparseRow', 'PivotStats', 'Range', 'In',
+           'Aggregation', 'GroupBy', 'Count', 'Sum', 'Mean', 'Min', 'Max']
 
 class PivotTableError(Exception):
     pass
 
 class Aggregation(object):
-
-    values = []
+    """Template for the operations applied to every value that falls in the
+    same cell of the table (i.e. same key and same xaxis value). A new
+    instance is created for every cell, so subclasses should keep just enough
+    state to produce the final value instead of storing every value received:
+        * append(value): called once for every row that falls in the cell
+        * __call__(): return the aggregated value of the cell
+        * merge(other): add the values received by other, an instance of the
+          same class, as if they had been appended to this one. This is what
+          subtotals and totals are built with
+    By convention None values are ignored, the same way SQL aggregate
+    functions ignore NULLs.
+    """
 
     def append(self, value):
-        self.values.append(value)
+        raise(NotImplementedError)
+
+    def merge(self, other):
+        raise(NotImplementedError)
 
     def __call__(self):
         raise(NotImplementedError)
@@ -72,26 +118,1479 @@ class Aggregation(object):
 class GroupBy(Aggregation):
     pass
 
+class Count(Aggregation):
+    """Number of values (other than None) received"""
+
+    def __init__(self):
+        self.count = 0
+
+    def append(self, value):
+        if value is not None:
+            self.count += 1
+
+    def merge(self, other):
+        self.count += other.count
+
+    def __call__(self):
+        return self.count
+
 class Sum(Aggregation):
+    """Sum of the values received. The first value is kept as is, so any
+    object that supports '+' can be used"""
+
+    def __init__(self):
+        self.total = None
+
+    def append(self, value):
+        if value is None:
+            return
+        if self.total is None:
+            self.total = value
+        else:
+            self.total = self.total + value
+
+    def merge(self, other):
+        self.append(other.total)
+
+    def __call__(self):
+        return self.total
+
+class Mean(Aggregation):
+    """Arithmetic mean of the values received"""
+
+    def __init__(self):
+        self.total = None
+        self.count = 0
+
+    def append(self, value):
+        if value is None:
+            return
+        if self.total is None:
+            self.total = value
+        else:
+            self.total = self.total + value
+        self.count += 1
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if self.total is None:
+            self.total = other.total
+        else:
+            self.total = self.total + other.total
+        self.count += other.count
 
     def __call__(self):
-        return sum(self.values)
+        if not self.count:
+            return None
+        return self.total / self.count
+
+class Min(Aggregation):
+    """Smallest of the values received"""
+
+    def __init__(self):
+        self.value = None
+
+    def append(self, value):
+        if value is not None and (self.value is None or value < self.value):
+            self.value = value
+
+    def merge(self, other):
+        self.append(other.value)
+
+    def __call__(self):
+        return self.value
+
+class Max(Aggregation):
+    """Greatest of the values received"""
+
+    def __init__(self):
+        self.value = None
+
+    def append(self, value):
+        if value is not None and (self.value is None or value > self.value):
+            self.value = value
+
+    def merge(self, other):
+        self.append(other.value)
+
+    def __call__(self):
+        return self.value
+
+class Rows(list):
+    """A list of rows that keeps track of its own modifications so that
+    PivotTable can cache its work. Appending rows (append, extend, +=) keeps
+    everything already aggregated valid: only the new rows will be aggregated
+    the next time the table is read. Any other modification (replacing,
+    inserting, removing or reordering rows) increments generation, which
+    tells PivotTable the cached aggregation must be rebuilt.
+    Changes made to the attributes of the objects themselves cannot be
+    detected: reassign rows (or call PivotTable.invalidate) after modifying
+    them"""
+
+    generation = 0
+
+    def _touch(self):
+        self.generation += 1
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self._touch()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._touch()
+
+    def __setslice__(self, i, j, sequence): # python 2 only
+        list.__setslice__(self, i, j, sequence)
+        self._touch()
+
+    def __delslice__(self, i, j): # python 2 only
+        list.__delslice__(self, i, j)
+        self._touch()
+
+    def __imul__(self, n):
+        self._touch()
+        return list.__imul__(self, n)
+
+    def insert(self, index, value):
+        list.insert(self, index, value)
+        self._touch()
+
+    def pop(self, *args):
+        self._touch()
+        return list.pop(self, *args)
+
+    def remove(self, value):
+        list.remove(self, value)
+        self._touch()
+
+    def reverse(self):
+        list.reverse(self)
+        self._touch()
+
+    def sort(self, *args, **kw):
+        list.sort(self, *args, **kw)
+        self._touch()
+
+    def clear(self):
+        del self[:]
+
+    def has_attr(self, name):
+        return all(_has_attr(i, name) for i in self)
+
+    def access(self):
+        """How the attributes of the rows are read, found out from the first
+        one (see PivotSpec)"""
+        if not self:
+            return 'attr'
+        return _access(self[0])
+
+    _indexes = None
+
+    def add_index(self, *attrs):
+        """Index the rows by the value of every attribute in attrs: pivots
+        whose where filters on any of them only read the matching rows. The
+        index is built the first time it is needed and kept up to date
+        (appends extend it, other modifications rebuild it)"""
+        if self._indexes is None:
+            self._indexes = {}
+        for a in attrs:
+            self._indexes.setdefault(a, None)
+
+    def _index(self, attr):
+        """The index of attr: a dict of value to the positions of the rows
+        with that value"""
+        state = self._indexes[attr]
+        if state is None or state[0]!=self.generation or state[1]>len(self):
+            state = (self.generation, 0, {})
+        generation, done, index = state
+        if done<len(self):
+            get = _getter((attr,), self.access())
+            for n in range(done, len(self)):
+                v = get(self[n])
+                try:
+                    index[v].append(n)
+                except KeyError:
+                    index[v] = [n]
+            state = (generation, len(self), index)
+        self._indexes[attr] = state
+        return index
+
+    def matching(self, where, start=0):
+        """The rows from position start on that may match the conditions in
+        where (a sequence of (attr, condition) pairs, see PivotSpec) according
+        to the indexes, or None if no attribute of where is indexed"""
+        if not self._indexes:
+            return None
+        positions = None
+        for attr, cond in where:
+            if attr not in self._indexes:
+                continue
+            found = cond.lookup(self._index(attr))
+            if positions is None or len(found)<len(positions):
+                positions = found
+        if positions is None:
+            return None
+        return [self[n] for n in sorted(positions) if n>=start]
+
+class Stream(object):
+    """One-shot rows: any iterator (a generator, a csv reader, a DB cursor,
+    etc). Nothing is read until headers or result are requested: then every
+    row is consumed and aggregated in a single pass, and only the aggregated
+    cells are kept, so memory is bounded by the size of the table and not by
+    the number of rows. Since rows cannot be read twice, the pivot definition
+    can not be changed once they were consumed"""
+
+    generation = 0
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.consumed = False
+        self._head = None
+
+    def __iter__(self):
+        if self.consumed:
+            raise PivotTableError("The rows were already consumed")
+        self.consumed = True
+        return iter(self.iterable)
+
+    def access(self):
+        """How the attributes of the rows are read, found out from the first
+        one (see PivotSpec). It is read ahead and kept for the pivot"""
+        if self._head is None and not self.consumed:
+            rows = iter(self.iterable)
+            self._head = list(islice(rows, 1))
+            self.iterable = chain(self._head, rows)
+        if not self._head:
+            return 'attr'
+        return _access(self._head[0])
+
+    def has_attr(self, name):
+        # it cannot be checked without consuming the rows
+        return True
+
+class _Equals(object):
+    """A where condition: values equal to value"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, value):
+        return value==self.value
+
+    def lookup(self, index):
+        return index.get(self.value, ())
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and self.value==other.value
+
+    def __ne__(self, other):
+        return not self==other
+
+    def __hash__(self):
+        return hash(self.value)
+
+class Range(object):
+    """A where condition: values between low and high, both included. Either
+    of them can be None to leave that side open; None values never match"""
+
+    def __init__(self, low=None, high=None):
+        self.low = low
+        self.high = high
+
+    def __call__(self, value):
+        if value is None:
+            return False
+        return (self.low is None or value>=self.low) and \
+               (self.high is None or value<=self.high)
+
+    def lookup(self, index):
+        positions = []
+        for v, found in index.items():
+            if self(v):
+                positions += found
+        return positions
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and \
+               (self.low, self.high)==(other.low, other.high)
+
+    def __ne__(self, other):
+        return not self==other
+
+    def __hash__(self):
+        return hash((self.low, self.high))
+
+    def __repr__(self):
+        return 'Range(%r, %r)' % (self.low, self.high)
+
+class In(object):
+    """A where condition: values in a set of values"""
+
+    def __init__(self, values):
+        self.values = frozenset(values)
+
+    def __call__(self, value):
+        return value in self.values
+
+    def lookup(self, index):
+        positions = []
+        for v in self.values:
+            positions += index.get(v, ())
+        return positions
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and \
+               self.values==other.values
+
+    def __ne__(self, other):
+        return not self==other
+
+    def __hash__(self):
+        return hash(self.values)
+
+    def __repr__(self):
+        # the values may not be comparable with each other (e.g. None)
+        return 'In(%r)' % (sorted(self.values, key=repr),)
+
+def _condition(value):
+    # compiled conditions (e.g. the where of a worker plan) are kept as is
+    if isinstance(value, (_Equals, Range, In)):
+        return value
+    return _Equals(value)
+
+def _row_filter(where, access='attr'):
+    """A callable that tells whether a row matches every condition of where
+    (a sequence of (attr, condition) pairs), reading all the attributes with
+    a single getter"""
+    get = _getter([a for a, cond in where], access)
+    if len(where)==1:
+        cond = where[0][1]
+        return lambda row: cond(get(row))
+    conds = [cond for a, cond in where]
+    def match(row):
+        for cond, v in zip(conds, get(row)):
+            if not cond(v):
+                return False
+        return True
+    return match
+
+def as_rows(value):
+    """Return value as one of the row sources PivotTable knows: Rows, Stream
+    or pivottable.columnar.Columns (or any object that already provides
+    aggregate)"""
+    if isinstance(value, dict) or \
+       getattr(getattr(value, 'dtype', None), 'names', None):
+        from .columnar import Columns
+        return Columns(value)
+    elif isinstance(value, (Rows, Stream)) or hasattr(value, 'aggregate'):
+        return value
+    elif iter(value) is value:
+        return Stream(value)
+    return Rows(value)
+
+def _getter(attrs, access='attr'):
+    """Return a callable that fetches attrs from a row: the bare value if
+    there is only one attr, a tuple otherwise. access tells how the row is
+    read (see _access)"""
+    if access=='attr' or (access!='item' and
+                          not all(a in access for a in attrs)):
+        # dotted names are resolved as attributes in namedtuples too
+        get, fallback = attrgetter, o_attrgetter
+    else:
+        if access!='item':
+            # namedtuple fields are read by position
+            attrs = [access.index(a) for a in attrs]
+        get, fallback = itemgetter, o_itemgetter
+    try:
+        return get(*attrs)
+    except TypeError:
+        # python < 2.5 or no attrs at all
+        return fallback(*attrs)
+
+def _access(row):
+    """How the attributes of rows like row are read: 'item' (row[name]) for
+    mappings and sequences, the tuple of field names for namedtuples (read by
+    position) and 'attr' (getattr) for any other object"""
+    if isinstance(row, tuple) and hasattr(row, '_fields'):
+        return tuple(row._fields)
+    if isinstance(row, (Mapping, list, tuple)):
+        return 'item'
+    return 'attr'
+
+def _has_attr(row, name):
+    if isinstance(row, Mapping):
+        return name in row
+    if isinstance(row, (list, tuple)) and not hasattr(row, '_fields'):
+        return isinstance(name, int) and -len(row)<=name<len(row)
+    return hasattr(row, name)
+
+# the sort orders of keys and xaxis values (see PivotTable.yaxis_sort)
+_ORDERS = {True:'sorted', 'sorted':'sorted',
+           False:'insertion', 'insertion':'insertion'}
+
+def _grouped(keys, depth):
+    """keys (tuples of depth values) in the same order, except that the keys
+    that share a prefix are moved next to the first one with it"""
+    ranks = [{} for i in range(depth - 1)]
+    def rank(k):
+        return tuple(r.setdefault(k[:n + 1], len(r))
+                     for n, r in enumerate(ranks))
+    # sorted computes the ranks in the order of keys and is stable
+    return sorted(keys, key=rank)
+
+def _collated(values, order, cache):
+    """values sorted by the sort key order, computed once per value (cache
+    keeps them between sorts)"""
+    def key(v):
+        try:
+            return cache[v]
+        except KeyError:
+            r = cache[v] = order(v)
+            return r
+    return sorted(values, key=key)
+
+def _dummy_formatter(value):
+    """Return the same value as submitted in unicode"""
+    if value is None: return None
+    return str(value)
+
+class PivotStats(object):
+    """Timers and counters of a read of a pivot (see PivotTable.instrument).
+
+    timers maps every phase to the seconds spent in it: 'aggregate' (the
+    grouping pass), 'getattr' (reading the attributes of the rows, part of
+    aggregate), 'sort' (sorting keys and xaxis values), 'headers', 'render'
+    (building the rows of the result) and 'format' (calls to the formatters,
+    part of render). The counters are rows (rows scanned: cached reads only
+    scan the appended ones), keys (distinct keys), xvalues (distinct xaxis
+    values), cells (aggregated cells written to the result) and
+    format_calls"""
+
+    def __init__(self):
+        self.timers = {}
+        self.rows = 0
+        self.keys = 0
+        self.xvalues = 0
+        self.cells = 0
+        self.format_calls = 0
+
+    def add(self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0) + seconds
+
+    def phase(self, phase):
+        """A context manager that adds the time spent in it to phase"""
+        return _Timer(self, phase)
+
+    def timed(self, phase, func):
+        """func, adding the time spent in every call to phase"""
+        add = self.add
+        def g(*args):
+            start = timer()
+            try:
+                return func(*args)
+            finally:
+                add(phase, timer() - start)
+        return g
+
+    def formatter(self, func):
+        """func, counted and timed as a formatter"""
+        timed = self.timed('format', func)
+        def g(value):
+            self.format_calls += 1
+            return timed(value)
+        return g
+
+    def as_dict(self):
+        """Every timer (as '<phase>_s') and counter in a flat dict, to
+        forward to a metrics system"""
+        d = dict(('%s_s' % k, v) for k, v in self.timers.items())
+        for k in ('rows', 'keys', 'xvalues', 'cells', 'format_calls'):
+            d[k] = getattr(self, k)
+        return d
+
+    def __repr__(self):
+        return '<PivotStats %s>' % ', '.join(
+            '%s=%s' % i for i in sorted(self.as_dict().items()))
+
+class _Timer(object):
+
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = timer()
+
+    def __exit__(self, *exc):
+        self.stats.add(self.phase, timer() - self.start)
+
+class _NoTimer(object):
+    """What PivotSpec times phases with when there are no stats"""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+_no_timer = _NoTimer()
+
+def _memoized(func, size):
+    """func with a memo of the results of its last size distinct values (in
+    an LRU cache when available). Values that cannot be hashed are not
+    memoized"""
+    if lru_cache is not None:
+        # typed: 1 and 1.0 are the same key, but not the same text
+        cached = lru_cache(size, typed=True)(func)
+        def g(value):
+            try:
+                hash(value)
+            except TypeError:
+                return func(value)
+            return cached(value)
+        return g
+    memo = {}
+    def g(value):
+        key = (value.__class__, value)
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return func(value)
+        if len(memo)>=size:
+            memo.clear()
+        r = memo[key] = func(value)
+        return r
+    return g
+
+def _raw_formatter(value):
+    """Return the same value as submitted"""
+    return value
+
+class _Aggregated(object):
+    """The aggregated cells of a pivot along with what is needed to know
+    whether they are still valid for the current rows"""
+
+    def __init__(self, sig, rows):
+        self.sig = sig
+        self.rows = rows
+        self.generation = rows.generation
+        self.seen = 0 # how many rows were already aggregated
+        self.complete = False # whether rows that are not a Rows were read
+        self.groups = {} # key -> {xaxis value -> [Aggregation, ...]}
+        self.keys = [] # sorted keys of groups
+        self.xvalues = OrderedDict() # in the order they were found
+        self.sorted_xvalues = None # (xaxis_sort, ordered xvalues)
+        self.collation = {} # key -> sort key, for a yaxis_sort callable
+        self.x_collation = {} # the same for xaxis values
+        self.ncells = 0 # cells in groups, to check the memory budget
+        self.cell_size = None # estimated bytes per cell
+        self.runs = [] # temp files with the groups spilled to disk
+
+class PivotSpec(object):
+    """A pivot definition (see PivotTable for the meaning of every argument)
+    validated and compiled once: labels, formatters, aggregations and the
+    getters of every attribute are resolved up front, so the spec can be
+    applied to any number of row sets without looking anything up per row or
+    per cell. PivotTable compiles one from its attributes every time it is
+    read; build one yourself to run the same layout against many datasets:
+
+        spec = PivotSpec('month', yaxis, ['city', 'office'])
+        for rows in datasets:
+            table = list(spec.apply(rows))
+
+    access is the only argument PivotTable does not have: it tells how the
+    attributes of the rows are read, and PivotTable picks it from the first
+    row. 'attr' reads them with getattr; 'item' with row[attr], for dicts
+    and other mappings, and for tuples and lists (attrs are then positions);
+    for namedtuples, pass the tuple of their fields to read them by position.
+    """
+
+    def __init__(self, xaxis, yaxis, yaxis_order=(), xaxis_format=None,
+                 xaxis_sort=True, calculate_subtotals=False,
+                 calculate_totals=False, subtotal_label='Subtotal',
+                 total_label='Total', workers=None, chunksize=50000,
+                 memory_limit=None, stats=None, format_cache=None,
+                 series=False, where=None, access='attr', yaxis_sort=True):
+        if xaxis is None:
+            raise PivotTableError
+        for order in (xaxis_sort, yaxis_sort):
+            if not (order in _ORDERS or callable(order)):
+                raise PivotTableError("Unknown sort order: %r" % (order,))
+        if memory_limit and _ORDERS.get(yaxis_sort)!='sorted':
+            # runs are merged in the natural order of the keys
+            raise PivotTableError("memory_limit needs the keys sorted")
+        for i in yaxis:
+            if 'attr' not in i or 'label' not in i or 'aggr' not in i:
+                raise PivotTableError
+        yaxis_order = tuple(yaxis_order)
+        groupby = [n['attr'] for n in yaxis if n['aggr']==GroupBy]
+        for i in yaxis_order:
+            if i not in groupby:
+                raise PivotTableError("%s is not a GroupBy attribute" % i)
+        metrics = [n for n in yaxis if n['aggr']!=GroupBy]
+        if isinstance(xaxis, (list, tuple)):
+            # composite columns: one tuple of values per column
+            xaxis = tuple(xaxis)
+            if not xaxis:
+                raise PivotTableError("xaxis needs at least one attribute")
+            self.xaxis_attrs = xaxis
+        else:
+            self.xaxis_attrs = (xaxis,)
+        self.xaxis = xaxis
+        self.yaxis_order = yaxis_order
+        self.xaxis_format = xaxis_format
+        self.xaxis_sort = xaxis_sort
+        self.yaxis_sort = yaxis_sort
+        self.calculate_subtotals = calculate_subtotals
+        self.calculate_totals = calculate_totals
+        self.subtotal_label = subtotal_label
+        self.total_label = total_label
+        self.workers = workers
+        self.chunksize = chunksize
+        self.memory_limit = memory_limit
+        self.attrs = [m['attr'] for m in metrics]
+        self.aggrs = [m['aggr'] for m in metrics]
+        self.labels = [m.get('label', m['attr']) for m in metrics]
+        self.formats = [m.get('format', _dummy_formatter) for m in metrics]
+        # the accessor is picked once: getattr, or C-level itemgetter for
+        # mapping, sequence and namedtuple rows
+        self.access = access
+        self.key_getter = _getter(yaxis_order, access)
+        self.x_getter = _getter(self.xaxis_attrs, access)
+        if self.attrs:
+            self.values_getter = _getter(self.attrs, access)
+        else:
+            self.values_getter = None
+        # the columns before the pivotted ones: the yaxis_order keys, the
+        # metric label and any other 'group by' attribute
+        self.key_headers = list(yaxis_order)
+        # series put the metrics side by side under every xaxis value, so
+        # there is no metric column
+        self.series = series
+        if "metric" not in self.key_headers and not series:
+            self.key_headers.append("metric")
+        self.key_headers += [i for i in groupby if i not in yaxis_order]
+        # (attr, condition) pairs, evaluated in the grouping pass
+        if where:
+            self.where = tuple(sorted((a, _condition(v)) for a, v in
+                                      where.items()))
+            self.row_filter = _row_filter(self.where, access)
+        else:
+            self.where = ()
+            self.row_filter = None
+        # whatever changes the aggregated cells
+        self.sig = (xaxis, yaxis_order, tuple(zip(self.attrs, self.aggrs)),
+                    self.where, yaxis_sort)
+        self.stats = stats
+        if stats is not None:
+            # every getter and formatter reports to stats
+            self.key_getter = stats.timed('getattr', self.key_getter)
+            self.x_getter = stats.timed('getattr', self.x_getter)
+            if self.values_getter is not None:
+                self.values_getter = stats.timed('getattr',
+                                                 self.values_getter)
+            self.formats = [stats.formatter(f) for f in self.formats]
+            self.xaxis_format = xaxis_format and \
+                                stats.formatter(xaxis_format)
+        self.format_cache = format_cache
+        if format_cache:
+            # values repeat a lot: remember the last format_cache results of
+            # every formatter
+            self.formats = [_memoized(f, format_cache) for f in self.formats]
+            self.xaxis_format = self.xaxis_format and \
+                                _memoized(self.xaxis_format, format_cache)
+
+    def _phase(self, phase):
+        if self.stats is None:
+            return _no_timer
+        return self.stats.phase(phase)
+
+    def apply(self, rows):
+        """Pivot rows (anything PivotTable.rows accepts) and return the result
+        as PivotTable.result does"""
+        return self.render(self.aggregate(as_rows(rows)))
+
+    def aggregate(self, rows, c=None):
+        """Bring the aggregated cells c up to date with rows, a row source
+        (see as_rows), and return them. c is reused as long as it belongs to
+        this definition and rows were only appended to since; otherwise (or
+        when c is None) every row is aggregated again"""
+        if c is None or c.sig!=self.sig or c.rows is not rows or \
+           c.generation!=rows.generation or \
+           (isinstance(rows, Rows) and c.seen>len(rows)):
+            c = _Aggregated(self.sig, rows)
+        if self.workers:
+            feed = self._aggregate_parallel
+        elif self.memory_limit:
+            feed = self._aggregate_bounded
+        else:
+            feed = self._aggregate
+        seen = c.seen
+        with self._phase('aggregate'):
+            if isinstance(rows, Rows):
+                if c.seen<len(rows):
+                    subset = None
+                    if self.where:
+                        subset = rows.matching(self.where, c.seen)
+                    if subset is not None:
+                        # an index gave the rows that may match: the rest
+                        # are skipped without being read
+                        feed(c, subset)
+                        c.seen = len(rows)
+                    elif c.seen:
+                        feed(c, rows[c.seen:])
+                    else:
+                        feed(c, rows)
+            elif c.complete:
+                pass
+            elif isinstance(rows, Stream):
+                feed(c, rows)
+                c.complete = True
+            else:
+                # rows that know how to aggregate themselves (e.g. Columns)
+                rows.aggregate(c, self)
+        if self.stats is not None:
+            self.stats.rows += c.seen - seen
+            self.stats.xvalues = len(c.xvalues)
+            if not c.runs:
+                # spilled keys are counted as they are merged (see _cells)
+                self.stats.keys = len(c.keys)
+        return c
+
+    def _aggregate(self, c, rows):
+        """Feed every row, in a single pass, to the aggregations of the cell it
+        belongs to and update the groups, keys and xvalues of c. Every key
+        maps to a dict of xaxis values to the list of Aggregation instances of
+        that cell (one for every metric)"""
+        new_keys = self._feed(c, rows)
+        if new_keys:
+            with self._phase('sort'):
+                self._add_keys(c, new_keys)
+
+    def _add_keys(self, c, new_keys):
+        """Add new_keys (keys that were not in c, in the order they were
+        found) to the keys of c, keeping them in the order set by
+        yaxis_sort"""
+        order = _ORDERS.get(self.yaxis_sort, self.yaxis_sort)
+        if order=='sorted':
+            # bonus point: we order the data. Only the distinct keys are
+            # sorted and, when rows are appended, the already sorted keys make
+            # this almost linear
+            c.keys.extend(new_keys)
+            c.keys.sort()
+        else:
+            c.keys.extend(new_keys)
+            if order!='insertion':
+                c.keys = _collated(c.keys, order, c.collation)
+            if len(self.yaxis_order)>1:
+                # the keys that share a prefix are kept together, as they
+                # are shown in the table (and added up in subtotals)
+                c.keys = _grouped(c.keys, len(self.yaxis_order))
+
+    def _feed(self, c, rows):
+        """The grouping pass of _aggregate. Return the keys that were not in
+        c, unsorted"""
+        kd = self.key_getter
+        xd = self.x_getter
+        vd = self.values_getter
+        single = len(self.attrs)==1
+        aggrs = self.aggrs
+        groups = c.groups
+        new_keys = []
+        seen = c.seen
+        match = self.row_filter
+        for i in rows:
+            seen += 1
+            if match is not None and not match(i):
+                continue
+            k = kd(i)
+            try:
+                cells = groups[k]
+            except KeyError:
+                cells = groups[k] = {}
+                new_keys.append(k)
+            x = xd(i)
+            try:
+                cell = cells[x]
+            except KeyError:
+                cell = cells[x] = [a() for a in aggrs]
+                c.ncells += 1
+                if x not in c.xvalues:
+                    c.xvalues[x] = None
+                    c.sorted_xvalues = None
+            if single:
+                cell[0].append(vd(i))
+            elif vd is not None:
+                for a, v in zip(cell, vd(i)):
+                    a.append(v)
+        c.seen = seen
+        return new_keys
+
+    def _aggregate_bounded(self, c, rows):
+        """Same as _aggregate, but whenever the groups held in memory go over
+        memory_limit bytes they are sorted by key and spilled to a temp file
+        (a run). The runs are combined with a k-way merge when the table is
+        rendered (see _cells)"""
+        rows = iter(rows)
+        block = list(islice(rows, 4096))
+        while block:
+            self._feed(c, block)
+            self._check_budget(c)
+            block = list(islice(rows, 4096))
+        with self._phase('sort'):
+            c.keys = sorted(c.groups)
+
+    def _check_budget(self, c):
+        """Spill the groups of c to a new run if their estimated size is over
+        memory_limit"""
+        if not c.ncells:
+            return
+        if c.cell_size is None:
+            c.cell_size = _cell_size(c.groups)
+        if c.ncells*c.cell_size<=self.memory_limit:
+            return
+        f = TemporaryFile()
+        dump = pickle.dump
+        for k in sorted(c.groups):
+            # one pickle per group: a single Pickler would keep a reference
+            # to every object it wrote
+            dump((k, c.groups[k]), f, pickle.HIGHEST_PROTOCOL)
+        c.runs.append(f)
+        c.groups = {}
+        c.keys = []
+        c.ncells = 0
+
+    def _aggregate_parallel(self, c, rows):
+        """Same as _aggregate, but rows are split in partitions of chunksize
+        rows that are aggregated in a process pool (workers is either the
+        number of processes or an executor to reuse). The partial aggregations
+        are merged in the order of their partitions, so keys and columns come
+        out exactly as in the serial path; just keep in mind float sums may
+        differ in the last digits since they are added in another order.
+        Rows and aggregations must be picklable"""
+        if hasattr(self.workers, 'submit'):
+            executor = self.workers
+            window = 4
+        elif ProcessPoolExecutor is None:
+            raise PivotTableError("concurrent.futures is required to use "
+                                  "workers")
+        else:
+            executor = ProcessPoolExecutor(self.workers)
+            window = 2*self.workers
+        # formatters and getters may not be picklable: workers get just the
+        # names and aggregations and compile their own spec
+        plan = (self.xaxis, self.yaxis_order, self.attrs, self.aggrs,
+                self.where, self.access)
+        pending = deque()
+        new_keys = []
+        try:
+            rows = iter(rows)
+            chunk = list(islice(rows, self.chunksize))
+            while chunk or pending:
+                if chunk:
+                    pending.append(executor.submit(_aggregate_partition, plan,
+                                                   chunk))
+                    c.seen += len(chunk)
+                    chunk = list(islice(rows, self.chunksize))
+                # only a few partitions are in flight at any time
+                if pending and (len(pending)>=window or not chunk):
+                    new_keys += _merge_partial(c, *pending.popleft().result())
+                    if self.memory_limit:
+                        self._check_budget(c)
+        finally:
+            if executor is not self.workers:
+                executor.shutdown()
+        with self._phase('sort'):
+            if self.memory_limit:
+                c.keys = sorted(c.groups)
+            elif new_keys:
+                self._add_keys(c, new_keys)
+
+    def _xvalues(self, c):
+        """The xaxis values of c in the order set by xaxis_sort"""
+        cached = c.sorted_xvalues
+        if cached is None or cached[0]!=self.xaxis_sort:
+            if cached is not None:
+                # the sort keys belong to the previous order
+                c.x_collation = {}
+            order = _ORDERS.get(self.xaxis_sort, self.xaxis_sort)
+            xvalues = list(c.xvalues)
+            with self._phase('sort'):
+                if order=='sorted':
+                    xvalues.sort()
+                elif order!='insertion':
+                    xvalues = _collated(xvalues, order, c.x_collation)
+            cached = c.sorted_xvalues = (self.xaxis_sort, xvalues)
+        return cached[1]
+
+    def headers(self, c):
+        """The values of the header row for the aggregated cells c"""
+        with self._phase('headers'):
+            return self._headers(c)
+
+    def _headers(self, c):
+        headers = list(self.key_headers)
+        xvalues = self._xvalues(c)
+        if self.series:
+            # one column for every metric under every xaxis value
+            for x in xvalues:
+                headers += [self._series_header(x, l) for l in self.labels]
+            if self.calculate_totals:
+                total = self.total_label
+                if len(self.xaxis_attrs)>1:
+                    total = (total,) + (None,)*(len(self.xaxis_attrs)-1)
+                headers += [self._series_header(total, l)
+                            for l in self.labels]
+            return headers
+        headers += xvalues
+        if self.calculate_totals:
+            headers.append(self.total_label)
+        return headers
+
+    def _series_header(self, x, label):
+        if len(self.xaxis_attrs)>1:
+            return x + (label,)
+        return (x, label)
+
+    def _total_width(self):
+        """The number of total columns"""
+        if not self.calculate_totals:
+            return 0
+        if self.series:
+            return len(self.attrs)
+        return 1
+
+    def render(self, c, raw=False):
+        """Build the final table out of the aggregated cells c. If raw is True
+        the cells hold the aggregated values instead of formatted ones (the
+        header row is always formatted)"""
+        if c.runs:
+            # spilled groups: stream the rows instead of building the table
+            return (n[1] for n in self.iter_rows(c, raw))
+        r, layout = self._layout(c, raw)
+        with self._phase('render'):
+            for g in self._groups(c):
+                self._add_rows(r, layout, g[1], g[2])
+        return iter(r)
+
+    def iter_rows(self, c, raw=False):
+        """Same as render, but build the rows lazily, one group at a time,
+        and yield (kind, row) pairs: kind is 'header' for the header row,
+        'row', 'subtotal' or 'total'"""
+        headers, layout = self._layout(c, raw)
+        for h in headers:
+            yield 'header', h
+        groups = self._groups(c)
+        while True:
+            # only the time spent building the rows is rendering
+            with self._phase('render'):
+                g = next(groups, None)
+                if g is not None:
+                    r = []
+                    self._add_rows(r, layout, g[1], g[2])
+            if g is None:
+                return
+            for n in r:
+                yield g[0], n
+
+    def render_window(self, c, offset=0, limit=None, raw=False):
+        """The header rows and then limit rows (all of them if limit is None)
+        of the table, skipping the first offset ones. Only the rows of the
+        window are built and formatted"""
+        if offset<0 or (limit is not None and limit<0):
+            raise PivotTableError("offset and limit must not be negative")
+        r, layout = self._layout(c, raw)
+        per = len(layout.rows)
+        if limit is None:
+            stop = None
+        else:
+            stop = offset + limit
+        n = 0
+        with self._phase('render'):
+            for g in self._groups(c):
+                if stop is not None and n>=stop:
+                    break
+                if n + per>offset:
+                    rows = []
+                    self._add_rows(rows, layout, g[1], g[2])
+                    if stop is not None:
+                        rows = rows[:stop - n]
+                    r += rows[max(0, offset - n):]
+                n += per
+        return iter(r)
+
+    def render_top(self, c, n, metric, xvalue=None, largest=True, raw=False):
+        """The header rows and then the rows of the n keys with the largest
+        (or smallest) aggregated value of the metric labelled metric, in that
+        order: the value of the whole row (what the total column shows) or,
+        if xvalue is given, the value in that column. Keys without a value
+        come last. Keys are ranked with a heap of n items and only their rows
+        are built and formatted; subtotals and totals are left out"""
+        try:
+            k = self.labels.index(metric)
+        except ValueError:
+            raise PivotTableError("Unknown metric: %s" % metric)
+        aggr = self.aggrs[k]
+        def value(item):
+            cells = item[1]
+            if xvalue is None:
+                total = aggr()
+                for cell in cells.values():
+                    total.merge(cell[k])
+                v = total()
+            elif xvalue in cells:
+                v = cells[xvalue][k]()
+            else:
+                v = None
+            if largest:
+                return (v is not None, v)
+            return (v is None, v)
+        r, layout = self._layout(c, raw)
+        with self._phase('render'):
+            if largest:
+                ranked = nlargest(n, self._cells(c), key=value)
+            else:
+                ranked = nsmallest(n, self._cells(c), key=value)
+            for i, cells in ranked:
+                if len(self.yaxis_order)==1:
+                    i = (i,)
+                self._add_rows(r, layout, i, cells)
+        return iter(r)
+
+    def _layout(self, c, raw):
+        """The formatted header rows and the _Layout of the table"""
+        headers = self.headers(c)
+        if self.calculate_totals:
+            headers = headers[:-self._total_width()]
+        layout = _Layout(self, headers)
+        if raw:
+            layout.formats = [_raw_formatter]*len(self.formats)
+        return self._format_headers(headers), layout
+
+    def render_sparse(self, c):
+        """Same as render, but return a SparseResult that stores only the
+        populated cells of every row"""
+        headers, layout = self._layout(c, False)
+        rows = []
+        with self._phase('render'):
+            for g in self._groups(c):
+                self._add_sparse_rows(rows, layout, g[0], g[1], g[2])
+        return SparseResult(headers, layout.width, rows)
+
+    def _format_headers(self, headers):
+        """The header rows of the result, one for every xaxis attribute (plus
+        one for the metric labels of series): headers (minus the total
+        columns) formatted by xaxis_format. Composite columns get one of their
+        values in every row, and the key columns are only named in the last
+        one"""
+        x_format = self.xaxis_format or _dummy_formatter
+        def format_header(h):
+            try:
+               return x_format(h)
+            except AttributeError:
+                return _dummy_formatter(h)
+        depth = len(self.xaxis_attrs) + bool(self.series)
+        nk = len(self.key_headers)
+        rows = []
+        for level in range(depth):
+            last = level==depth-1
+            if last:
+                h_ = [format_header(h) for h in headers[:nk]]
+            else:
+                h_ = [None]*nk
+            if last and self.series:
+                # metric labels are not xaxis values
+                h_ += [h[level] for h in headers[nk:]]
+            else:
+                for h in headers[nk:]:
+                    if depth>1:
+                        h = h[level]
+                    h_.append(format_header(h))
+            if self.calculate_totals:
+                if not self.series:
+                    h_.append(last and self.total_label or None)
+                elif last:
+                    h_ += self.labels
+                else:
+                    h_ += [level==0 and self.total_label or None
+                           ]*len(self.labels)
+            rows.append(h_)
+        return rows
+
+    def _groups(self, c):
+        """Yield (kind, key values, cells) for every group of rows of the
+        table, in order: kind is 'row' for the aggregated keys, 'subtotal' or
+        'total'. cells is a dict of xaxis values to the list of aggregations
+        of every metric"""
+        depth = len(self.yaxis_order)
+        # subtotals[p] holds the merged cells of the key prefix of length p
+        # being subtotalled; they are filled from the already aggregated
+        # cells, the rows are not read again
+        subtotals = [None]*depth
+        if self.calculate_totals:
+            grand = {}
+        else:
+            grand = None
+        pkv = None
+        # for every ordered value
+        for i, cells in self._cells(c):
+            # attrgetter returns a bare value when there is just one key
+            if depth==1:
+                kv = (i,)
+            else:
+                kv = i
+            if self.calculate_subtotals:
+                # close the subtotals whose prefix changed, deepest first
+                for p in range(depth-1, 0, -1):
+                    if pkv is not None and kv[:p]!=pkv[:p]:
+                        yield ('subtotal', self._subtotal_key(pkv, p),
+                               subtotals[p])
+                    if pkv is None or kv[:p]!=pkv[:p]:
+                        subtotals[p] = {}
+                    self._merge_cells(subtotals[p], cells)
+            if grand is not None:
+                self._merge_cells(grand, cells)
+            yield ('row', kv, cells)
+            pkv = kv
+        if self.calculate_subtotals and pkv is not None:
+            for p in range(depth-1, 0, -1):
+                yield ('subtotal', self._subtotal_key(pkv, p), subtotals[p])
+        if grand is not None and depth:
+            yield ('total', (self.total_label,) + (None,)*(depth-1), grand)
+
+    def _cells(self, c):
+        """Yield (key, cells) for every key of c in order. Groups spilled to
+        runs are merged with the ones in memory, reading one group of every
+        run at a time"""
+        if not c.runs:
+            for k in c.keys:
+                yield k, c.groups[k]
+            return
+        # the run index breaks ties, so cells are never compared
+        sources = [_read_run(f, n) for n, f in enumerate(c.runs)]
+        sources.append((k, len(c.runs), c.groups[k]) for k in c.keys)
+        stats = self.stats
+        pk = None
+        parts = []
+        for k, n, cells in heap_merge(*sources):
+            if parts and k!=pk:
+                if stats is not None:
+                    stats.keys += 1
+                yield pk, self._combine(parts)
+                parts = []
+            pk = k
+            parts.append(cells)
+        if parts:
+            if stats is not None:
+                stats.keys += 1
+            yield pk, self._combine(parts)
+
+    def _combine(self, parts):
+        """The cells of a key found in several runs merged together (into
+        new aggregations: the cells in memory are still cached)"""
+        if len(parts)==1:
+            return parts[0]
+        merged = {}
+        for cells in parts:
+            self._merge_cells(merged, cells)
+        return merged
+
+    def _subtotal_key(self, kv, p):
+        """The key values shown in a subtotal row of the prefix kv[:p]"""
+        return kv[:p] + (self.subtotal_label,) + (None,)*(len(kv)-p-1)
+
+    @staticmethod
+    def _merge_cells(target, cells):
+        """Merge the aggregations in cells (a dict of xaxis values to a list
+        of aggregations) into the ones of target, creating them as needed"""
+        for x, cell in cells.items():
+            try:
+                merged = target[x]
+            except KeyError:
+                merged = target[x] = [a.__class__() for a in cell]
+            for j in enumerate(cell):
+                merged[j[0]].merge(j[1])
+
+    def _add_rows(self, r, layout, kv, cells):
+        """Append to r one row for every metric (or a single row for series)
+        of the key values kv with the aggregated cells"""
+        width = layout.width
+        columns = layout.columns
+        if self.stats is not None:
+            self.stats.cells += len(self.attrs)*(len(cells) +
+                                                 (layout.total is not None))
+        for metrics in layout.rows:
+            n = [None]*width
+            if layout.metric is not None:
+                n[layout.metric] = self.labels[metrics[0]]
+            # find the text for every 'group by' key and assign it
+            for l in zip(layout.keys, kv):
+                n[l[0]] = l[1]
+            for k in metrics:
+                # apply format to the result, in case there is no format
+                # defined, use a boilerplate one just not to branch the code
+                m_format = layout.formats[k]
+                o = layout.offsets[k]
+                for x, cell in cells.items():
+                    n[columns[x] + o] = m_format(cell[k]())
+                if layout.total is not None:
+                    total = self.aggrs[k]()
+                    for cell in cells.values():
+                        total.merge(cell[k])
+                    n[layout.total + o] = m_format(total())
+            r.append(n)
+
+    def _add_sparse_rows(self, r, layout, kind, kv, cells):
+        """Append to r one SparseRow for every metric (or a single one for
+        series) of the key values kv with the aggregated cells"""
+        columns = layout.columns
+        if self.stats is not None:
+            self.stats.cells += len(self.attrs)*(len(cells) +
+                                                 (layout.total is not None))
+        for metrics in layout.rows:
+            head = [None]*layout.nk
+            if layout.metric is not None:
+                head[layout.metric] = self.labels[metrics[0]]
+            for l in zip(layout.keys, kv):
+                head[l[0]] = l[1]
+            values = {}
+            for k in metrics:
+                m_format = layout.formats[k]
+                o = layout.offsets[k]
+                for x, cell in cells.items():
+                    values[columns[x] + o] = m_format(cell[k]())
+                if layout.total is not None:
+                    total = self.aggrs[k]()
+                    for cell in cells.values():
+                        total.merge(cell[k])
+                    values[layout.total + o] = m_format(total())
+            r.append(SparseRow(kind, head, values))
+
+class SparseRow(object):
+    """A row of a SparseResult: kind ('row', 'subtotal' or 'total'), head
+    (the values of the columns before the pivotted ones) and cells, a dict of
+    column index to value holding only the populated cells"""
+
+    __slots__ = ('kind', 'head', 'cells')
+
+    def __init__(self, kind, head, cells):
+        self.kind = kind
+        self.head = head
+        self.cells = cells
+
+    def dense(self, width):
+        """The row as a plain list of width values"""
+        n = self.head + [None]*(width-len(self.head))
+        for i, v in self.cells.items():
+            n[i] = v
+        return n
+
+class SparseResult(object):
+    """The result of a pivot that stores only the populated cells, for very
+    wide tables that are mostly empty: memory and build time depend on the
+    number of populated cells instead of rows x columns. Iterate over it to
+    get SparseRow instances (header rows excluded); densify or coordinates
+    lazily turn them into something else. header_rows holds every header row
+    (more than one for a composite xaxis) and headers the last one"""
+
+    def __init__(self, header_rows, width, rows):
+        self.header_rows = header_rows
+        self.headers = header_rows[-1]
+        self.width = width
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def densify(self):
+        """Yield plain lists, header rows included, the same as
+        PivotTable.result. Every list is built when it is requested"""
+        for h in self.header_rows:
+            yield list(h)
+        for row in self.rows:
+            yield row.dense(self.width)
+
+    def coordinates(self):
+        """Yield (row index, column index, value) for every populated cell of
+        the pivotted columns (row indexes start at 0 with the first row after
+        the header row)"""
+        for i, row in enumerate(self.rows):
+            for j in sorted(row.cells):
+                yield i, j, row.cells[j]
+
+class _Layout(object):
+    """Where every value goes in a row of the result: headers are mapped to
+    column indexes once per table instead of once per cell"""
+
+    __slots__ = ('width', 'nk', 'metric', 'keys', 'columns', 'total',
+                 'formats', 'rows', 'offsets')
+
+    def __init__(self, spec, headers):
+        self.formats = spec.formats
+        self.nk = nk = len(spec.key_headers)
+        self.width = len(headers)
+        self.keys = [spec.key_headers.index(a) for a in spec.yaxis_order]
+        m = len(spec.attrs)
+        if spec.series:
+            # a single row holds every metric: metric k goes k columns after
+            # the first one of its xaxis value
+            self.metric = None
+            self.rows = [tuple(range(m))]
+            self.offsets = list(range(m))
+            if len(spec.xaxis_attrs)>1:
+                xvalues = [h[:-1] for h in headers[nk::m]]
+            else:
+                xvalues = [h[0] for h in headers[nk::m]]
+            self.columns = dict((x[1], nk + x[0]*m) for x in
+                                enumerate(xvalues))
+        else:
+            self.metric = spec.key_headers.index('metric')
+            self.rows = [(k,) for k in range(m)]
+            self.offsets = [0]*m
+            self.columns = dict((h[1], h[0] + nk) for h in
+                                enumerate(headers[nk:]))
+        if spec.calculate_totals:
+            self.total = self.width
+            self.width += spec._total_width()
+        else:
+            self.total = None
+
+def _read_run(f, n):
+    """Yield (key, n, cells) for every group spilled to the run f"""
+    # every reader keeps its own position, so the same run can be read by
+    # several results at once
+    offset = 0
+    while True:
+        f.seek(offset)
+        try:
+            k, cells = pickle.load(f)
+        except EOFError:
+            return
+        offset = f.tell()
+        yield k, n, cells
+
+def _cell_size(groups):
+    """Rough estimate of the bytes taken by every cell of groups, measured on
+    the first group"""
+    size = sys.getsizeof
+    for k, cells in groups.items():
+        total = size(k) + size(cells) + 100 # 100: the entry in groups
+        for x, cell in cells.items():
+            total += size(x) + size(cell)
+            for a in cell:
+                total += size(a)
+                state = getattr(a, '__dict__', None)
+                if state is not None:
+                    total += size(state)
+                    for v in state.values():
+                        total += size(v)
+        return total//len(cells) + 1
+    return 0
+
+def _aggregate_partition(plan, rows):
+    """Process pool entry point: aggregate a partition of rows and return the
+    partial groups and the xaxis values in the order they were found"""
+    xaxis, yaxis_order, attrs, aggrs, where, access = plan
+    yaxis = [{'attr':a, 'label':a, 'aggr':GroupBy} for a in yaxis_order]
+    yaxis += [{'attr':a, 'label':a, 'aggr':g} for a, g in zip(attrs, aggrs)]
+    c = PivotSpec(xaxis, yaxis, yaxis_order, where=dict(where),
+                  access=access).aggregate(Rows(rows))
+    return c.groups, list(c.xvalues)
+
+def _merge_partial(c, groups, xvalues):
+    """Merge the partial groups of a partition into c. Return the keys that
+    were not in c"""
+    for x in xvalues:
+        if x not in c.xvalues:
+            c.xvalues[x] = None
+            c.sorted_xvalues = None
+    new_keys = []
+    for k, cells in groups.items():
+        try:
+            target = c.groups[k]
+        except KeyError:
+            c.groups[k] = cells
+            c.ncells += len(cells)
+            new_keys.append(k)
+            continue
+        for x, cell in cells.items():
+            try:
+                merged = target[x]
+            except KeyError:
+                target[x] = cell
+                c.ncells += 1
+                continue
+            for a, b in zip(merged, cell):
+                a.merge(b)
+    return new_keys
 
 class PivotTable(object):
 
-    yaxis_order = []
+    # immutable, so deleting the attribute of an instance falls back to no
+    # ordering without sharing anything
+    yaxis_order = ()
     xaxis_sort = True
-    rows = []
+    yaxis_sort = True
     calculate_subtotals = False
     calculate_totals = False
-    subtotal_label = None
-    total_label = None
+    subtotal_label = 'Subtotal'
+    total_label = 'Total'
+    workers = None
+    chunksize = 50000
+    memory_limit = None
+    instrument = False
+    stats_hook = None
+    lazy = False
+    format_cache = None
+    series = False
+    where = None
+    stats = None
 
-
-    _sheaders = set()
+    _cache = None
     _xaxis = None
-    _iod = OrderedDict() # inner ordered dict
-    _gk = []
+
+    def __init__(self, **kw):
+        """Every attribute can be set as a keyword argument (rows is always
+        set first, so xaxis can be checked against it). Any other name raises
+        a PivotTableError"""
+        cls = self.__class__
+        for k in kw:
+            default = getattr(cls, k, None)
+            if k.startswith('_') or not hasattr(cls, k) or \
+               callable(default) or \
+               (isinstance(default, property) and default.fset is None):
+                raise PivotTableError("Unknown attribute: %s" % k)
+        # all the state of the table belongs to the instance: tables can be
+        # pivotted concurrently, and the same table can be read from several
+        # threads (mutable defaults are set here, never on the class)
+        self._lock = threading.RLock()
+        self._rows = Rows()
+        self.yaxis_order = []
+        if 'rows' in kw:
+            self.rows = kw.pop('rows')
+        for k, v in kw.items():
+            setattr(self, k, v)
+
+    def __rows_get(self):
+        """The list of objects to pivot. Whatever is assigned is kept as a
+        Rows instance, so later appends only aggregate the new objects.
+        Iterators (generators, csv readers, DB cursors, etc) are kept as a
+        Stream instead, and read only once. NumPy structured arrays and dicts
+        of equal length arrays are kept as pivottable.columnar.Columns and
+        pivotted column-wise"""
+        return self._rows
+
+    def __rows_set(self, value):
+        self._rows = as_rows(value)
+
+    rows = property(__rows_get, __rows_set, doc=__rows_get.__doc__)
 
     def __xaxis_get(self):
         """The name of the object attribute that will be use to pivot values.
@@ -103,12 +1602,14 @@ class PivotTable(object):
         return self._xaxis
 
     def __xaxis_set(self, value):
-        old_val = self._xaxis
-        if not all(hasattr(i, value) for i in self.rows):
-            self._xaxis = old_val
-            raise PivotTableError
+        if isinstance(value, (list, tuple)):
+            value = tuple(value)
+            names = value
         else:
-            self._xaxis = value
+            names = (value,)
+        if not names or not all(self.rows.has_attr(n) for n in names):
+            raise PivotTableError
+        self._xaxis = value
 
     xaxis = property(__xaxis_get, __xaxis_set, doc=__xaxis_get.__doc__)
 
@@ -162,134 +1663,184 @@ class PivotTable(object):
     xaxis_format = property(__xaxis_format_get, __xaxis_format_set, 
                             doc=__xaxis_format_get.__doc__)
 
-    def _groupby_getter(self):
-        """Return all yaxis attributes that were defined as 'group by'"""
-        return [n.get('attr') for n in self.yaxis if n['aggr']==GroupBy]
-
-    def _notgroupby_getter(self):
-        """Return all yaxis attributes that were defined as not 'group by'"""
-        return [n.get('attr') for n in self.yaxis if n['aggr']!=GroupBy]
-
     @property
-    def headers(self):
-        self._populate_sheaders()
-        not_ = False
-        self._headers = []
-        try:
-            self._gk = [None]*len(self.yaxis_order)
-        except TypeError as e:
-            not_ = 0
+    def spec(self):
+        """The current definition compiled into a PivotSpec"""
+        if self.xaxis is None:
+            raise PivotTableError
         try:
-            for i in self._groupby_getter():
-                if i not in self.yaxis_order:
-                    self._headers.append(i)
-                else:
-                    try:
-                        self._gk[self.yaxis_order.index(i)] = i
-                    except IndexError:
-                        if not isinstance(not_, bool):
-                            self._gk[not_] = i
-                            not_ += 1
+            yaxis = self.yaxis
         except AttributeError:
             raise PivotTableError
-        # get rid of nonexistant values
         try:
-            while 1:
-                self._gk.remove(None)
-        except ValueError:
-            pass
-        if "metric" not in self._gk:
-            self._gk.append("metric")
-        self._headers = self._gk + self._headers
-        if self.xaxis_sort:
-            self._headers += sorted(self._sheaders)
-        else:
-            self._headers += list(self._sheaders)
-        self._iod = OrderedDict([(i,None) for i in self._headers])
-        return self._headers
+            xaxis_format = self.xaxis_format
+        except AttributeError:
+            xaxis_format = None
+        return PivotSpec(self.xaxis, yaxis, yaxis_order=self.yaxis_order,
+                         xaxis_format=xaxis_format,
+                         xaxis_sort=self.xaxis_sort,
+                         calculate_subtotals=self.calculate_subtotals,
+                         calculate_totals=self.calculate_totals,
+                         subtotal_label=self.subtotal_label,
+                         total_label=self.total_label, workers=self.workers,
+                         chunksize=self.chunksize,
+                         memory_limit=self.memory_limit,
+                         stats=self._new_stats(),
+                         format_cache=self.format_cache, series=self.series,
+                         where=self.where, access=self._access(),
+                         yaxis_sort=self.yaxis_sort)
+
+    def _access(self):
+        """How the attributes of rows are read (see PivotSpec)"""
+        access = getattr(self.rows, 'access', None)
+        if access is None:
+            # e.g. columnar rows, which are not read row by row
+            return 'attr'
+        return access()
+
+    def _new_stats(self):
+        if self.instrument or self.stats_hook is not None:
+            return PivotStats()
+        return None
+
+    def _report(self, stats):
+        """Publish the stats of a read that completed"""
+        self.stats = stats
+        if self.stats_hook is not None:
+            self.stats_hook(stats)
+
+    def _reporting(self, stats, rows):
+        """rows, publishing stats once they were all read"""
+        for r in rows:
+            yield r
+        self._report(stats)
+
+    def invalidate(self):
+        """Drop the cached aggregation, so the next read of headers or result
+        pivots every row again. Only needed if the objects in rows were
+        modified in place"""
+        with self._lock:
+            self._cache = None
+
+    @property
+    def headers(self):
+        spec = self.spec
+        with self._lock:
+            headers = spec.headers(self._sync(spec))
+        if spec.stats is not None:
+            self._report(spec.stats)
+        return headers
 
     @property
     def result(self):
-        # let's start building the final result
-        self._r = []
-        h_ = OrderedDict()
-        # boilerplate to make sure the headers are up2date
-        for h in enumerate(self.headers):
-            try:
-               h_["c%d" % h[0]] = self.xaxis_format(h[1])
-            except AttributeError:
-                h_["c%d" % h[0]] = self._dummy_formatter(h[1])
-        self._r.append(h_)
-        del h_
-        ngk = [i for i in self._notgroupby_getter()] # 'not group by' keys
-        # for every row we need to build the 'k_' that will represent an
-        # unique row in out final table. 
-        try:
-            kd = attrgetter(*self.yaxis_order)
-        except TypeError:
-            kd = o_attrgetter(*self.yaxis_order)
-        k_ = list(map(kd, self.rows))
-        # bonus point: we order the data
-        # we don't sort the list in place because we might have more than one
-        # object with the same key and because of that we have to set(list)
-        # which will return the data unordered 
-        try:
-            k_ = sorted(set(k_), key=itemgetter(*list(range(0, len(k_[0])))))
-        except TypeError:
-            k_ = sorted(set(k_), key=o_itemgetter(*list(range(0, len(k_[0])))))
-        except IndexError as e:
-            # if yaxis_order has just one value, we will have trouble with
-            # itemgetter on certain circumstances: let's try to catch that kind
-            # of problems. Strangely enough, we don't have problems when we
-            # don't define a yaxis_order
-            #if len(self.yaxis_order)==1:
-            k_ = sorted(set(k_))
-            #else:
-            #    raise(PivotTableError(e))
-        # for every ordered value
-        for i in k_:
-            # we get the list of appearances of a same key
-            for j in enumerate(filter(lambda x: kd(x)==i, self.rows)):
-                # we need to build an iod for every metric for this key...
-                for k in enumerate(ngk):
-                    # ... but only one time. we use cn as the index of the 
-                    # element we need to update
-                    if j[0]==0:
-                        cn = -1
-                        self._r.append(self._iod.copy())
-                    # if this is not the first time a same key appears, we
-                    # cannot add a new entry to the result, we need to use the
-                    # previous ones
-                    else:
-                        if k[0] == 0: cn = len(ngk)*-1
-                        else: cn += 1
-                    # find the label for the metric and assign it
-                    m_label = [m.get('label', k[1]) for m in \
-                               self.yaxis if m['attr']==k[1]]
-                    self._r[cn]['metric'] = m_label[0]
-                    # find the text for every 'group by' key and assign it
-                    for l in self.yaxis_order:
-                        self._r[cn][l] = getattr(j[1], l)
-                    # apply format to the result, in case there is no format
-                    # defined, use a boilerplate one just not to branch the
-                    # code
-                    m_format = [m.get('format', self._dummy_formatter) \
-                                for m in self.yaxis if m['attr']==k[1]]
-                    self._r[cn][getattr(j[1], self.xaxis)] = \
-                            m_format[0](getattr(j[1], k[1]))
-        return (list(n.values()) for n in self._r)
-
-    def _populate_sheaders(self):
-        """For every submitted row, find the attr mapped to xaxis and return a
-        list of them"""
-        self._sheaders = set()
-        if self.xaxis is None:
-            raise PivotTableError
-        for i in self.rows:
-            self._sheaders.add(getattr(i, self.xaxis))
+        return self._result(False)
 
-    @staticmethod
-    def _dummy_formatter(value):
-        """Return the same value as submitted in unicode"""
-        if value is None: return None
-        return str(value)
+    @property
+    def raw_result(self):
+        """The same table as result, but the cells hold the aggregated values
+        instead of formatted ones (the header row is still formatted)"""
+        return self._result(True)
+
+    def _result(self, raw):
+        spec = self.spec
+        with self._lock:
+            c = self._sync(spec)
+            if self.lazy:
+                # rows are built, and their cells formatted, as they are read
+                r = (n[1] for n in spec.iter_rows(c, raw))
+            else:
+                r = spec.render(c, raw)
+        if spec.stats is not None:
+            # the stats are complete once the result is read (spilled
+            # results are built as they are read)
+            r = self._reporting(spec.stats, r)
+        return r
+
+    def iter_rows(self):
+        """Yield (kind, row) for every row of result, header row included,
+        building them as they are requested: kind is 'header', 'row',
+        'subtotal' or 'total'. Used by the exporters in pivottable.export"""
+        spec = self.spec
+        with self._lock:
+            c = self._sync(spec)
+        if spec.stats is not None:
+            return self._reporting(spec.stats, spec.iter_rows(c))
+        return spec.iter_rows(c)
+
+    def window(self, offset=0, limit=None):
+        """The header rows of result and then limit rows (all of them if limit
+        is None) skipping the first offset ones. Only the rows of the window
+        are built and formatted"""
+        spec = self.spec
+        with self._lock:
+            r = spec.render_window(self._sync(spec), offset, limit)
+        if spec.stats is not None:
+            self._report(spec.stats)
+        return r
+
+    def top(self, n, metric, xvalue=None, largest=True):
+        """The header rows of result and then the rows of the n keys with the
+        largest (or smallest, if largest is False) value of the metric with
+        the label metric: the value of the whole row or, if xvalue is given,
+        the value in that column. Keys are ranked with a heap of n items and
+        only their rows are built and formatted"""
+        spec = self.spec
+        with self._lock:
+            r = spec.render_top(self._sync(spec), n, metric, xvalue, largest)
+        if spec.stats is not None:
+            self._report(spec.stats)
+        return r
+
+    def save(self, path):
+        """Save the result to path in the binary format read by
+        pivottable.load_result (see pivottable.storage)"""
+        from .storage import save_result
+        spec = self.spec
+        with self._lock:
+            c = self._sync(spec)
+            save_result(path, spec.render(c, raw=True), spec.labels,
+                        len(spec.key_headers),
+                        len(spec.xaxis_attrs) + bool(spec.series),
+                        spec.series)
+
+    @property
+    def sparse_result(self):
+        """The same table as result but as a SparseResult, which stores only
+        the populated cells"""
+        spec = self.spec
+        with self._lock:
+            sparse = spec.render_sparse(self._sync(spec))
+        if spec.stats is not None:
+            self._report(spec.stats)
+        return sparse
+
+    def _sync(self, spec):
+        """Bring the aggregated cells up to date with rows and return them.
+        The aggregation is cached: while the pivot definition is the same and
+        rows were only appended to, just the new rows are aggregated. Must be
+        called holding the lock"""
+        c = self._cache
+        # the cache is only stored once the aggregation succeeded, a failure
+        # halfway would leave it partially updated
+        self._cache = None
+        c = self._cache = spec.aggregate(self.rows, c)
+        return c
+
+def pivot_many(tables, max_workers=None):
+    """Compute the result of every PivotTable in tables on a thread pool and
+    yield (table, list of result rows) pairs as they complete. Useful when
+    the rows come from I/O bound sources or formatters release the GIL.
+    If a table fails, its exception is raised when its turn to be yielded
+    comes"""
+    if ThreadPoolExecutor is None:
+        raise PivotTableError("concurrent.futures is required by pivot_many")
+    executor = ThreadPoolExecutor(max_workers or 4)
+    try:
+        futures = dict((executor.submit(_materialize, t), t) for t in tables)
+        for f in as_completed(futures):
+            yield futures[f], f.result()
+    finally:
+        executor.shutdown()
+
+def _materialize(table):
+    return list(table.result)
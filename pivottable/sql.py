@@ -0,0 +1,196 @@
+# -*- coding: UTF-8 -*-
+"""Rows stored in a SQL database.
+
+Instead of fetching every row into Python objects, the pivot is translated
+into a single GROUP BY query over the keys and the xaxis attributes: the
+database computes the aggregations (and applies the where conditions) and
+only the aggregated cells are fetched, in batches. Any DB-API 2.0 connection
+works; sqlite3 is the reference:
+
+    import sqlite3
+    pt = PivotTable(rows=SQLTable(sqlite3.connect('sales.db'), 'sales'))
+"""
+from .pivottable import (
+    PivotTableError, Count, Sum, Mean, Min, Max, Range, In
+)
+
+__all__ = ['SQLTable']
+
+class SQLTable(object):
+    """The rows of a table (or view) of a database: connection is a DB-API
+    connection, paramstyle the one of its module and batch the number of
+    aggregated rows fetched at once. Attributes are the columns of the table.
+    The database can only compute the built in aggregations (Count, Sum,
+    Mean, Min and Max); any other one raises a PivotTableError. The data is
+    not watched for changes: call PivotTable.invalidate to read it again"""
+
+    generation = 0
+
+    def __init__(self, connection, table, paramstyle='qmark', batch=10000):
+        if paramstyle not in _placeholders:
+            raise PivotTableError("Unsupported paramstyle: %s" % paramstyle)
+        self.connection = connection
+        self.table = table
+        self.paramstyle = paramstyle
+        self.batch = batch
+        self._columns = None
+
+    def columns(self):
+        """The names of the columns of the table"""
+        if self._columns is None:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute('SELECT * FROM %s WHERE 1=0' %
+                               _quote_table(self.table))
+                self._columns = [d[0] for d in cursor.description]
+            finally:
+                cursor.close()
+        return self._columns
+
+    def has_attr(self, name):
+        return name in self.columns()
+
+    def query(self, spec):
+        """The GROUP BY query for the PivotSpec spec and its parameters"""
+        groups = [_quote(a) for a in spec.yaxis_order + spec.xaxis_attrs]
+        select = list(groups)
+        for aggr, attr in zip(spec.aggrs, spec.attrs):
+            try:
+                functions = _functions[aggr][1]
+            except KeyError:
+                raise PivotTableError("%s cannot be computed in SQL" %
+                                      aggr.__name__)
+            select += ['%s(%s)' % (f, _quote(attr)) for f in functions]
+        # the number of rows of every cell
+        select.append('COUNT(*)')
+        sql = 'SELECT %s FROM %s' % (', '.join(select),
+                                     _quote_table(self.table))
+        params = _Params(self.paramstyle)
+        conditions = [_where(attr, cond, params)
+                      for attr, cond in spec.where]
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if groups:
+            sql += ' GROUP BY ' + ', '.join(groups)
+        return sql, params.values
+
+    def aggregate(self, c, spec):
+        """Run the query of the PivotSpec spec and fill the groups, keys and
+        xvalues of c with the aggregated cells"""
+        for attr in spec.yaxis_order + spec.xaxis_attrs + tuple(spec.attrs):
+            if not self.has_attr(attr):
+                raise PivotTableError("Unknown column: %s" % attr)
+        sql, params = self.query(spec)
+        nk = len(spec.yaxis_order)
+        nx = len(spec.xaxis_attrs)
+        # how to turn the values fetched into aggregations
+        builders = [(aggr, _functions[aggr][0]) for aggr in spec.aggrs]
+        new = object.__new__
+        groups = c.groups
+        seen = 0
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                fetched = cursor.fetchmany(self.batch)
+                if not fetched:
+                    break
+                for row in fetched:
+                    # keys and xaxis values shaped the way attrgetter would
+                    if nk==1:
+                        k = row[0]
+                    else:
+                        k = tuple(row[:nk])
+                    if nx==1:
+                        x = row[nk]
+                    else:
+                        x = tuple(row[nk:nk + nx])
+                    cell = []
+                    i = nk + nx
+                    for aggr, names in builders:
+                        a = new(aggr)
+                        a.__dict__ = dict(zip(names, row[i:i + len(names)]))
+                        i += len(names)
+                        cell.append(a)
+                    seen += row[i]
+                    try:
+                        cells = groups[k]
+                    except KeyError:
+                        cells = groups[k] = {}
+                    cells[x] = cell
+                    c.ncells += 1
+                    if x not in c.xvalues:
+                        c.xvalues[x] = None
+        finally:
+            cursor.close()
+        c.sorted_xvalues = None
+        # the insertion order is the order of the rows of the query
+        spec._add_keys(c, list(groups))
+        c.seen = seen
+        c.complete = True
+
+# the state of every aggregation and the SQL functions that compute it
+_functions = {
+    Count: (('count',), ('COUNT',)),
+    Sum: (('total',), ('SUM',)),
+    Mean: (('total', 'count'), ('SUM', 'COUNT')),
+    Min: (('value',), ('MIN',)),
+    Max: (('value',), ('MAX',)),
+}
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+def _quote_table(table):
+    return '.'.join(_quote(n) for n in table.split('.'))
+
+_placeholders = {
+    'qmark': lambda n: '?',
+    'numeric': lambda n: ':%d' % n,
+    'named': lambda n: ':p%d' % n,
+    'format': lambda n: '%s',
+    'pyformat': lambda n: '%%(p%d)s' % n,
+}
+
+class _Params(object):
+    """The parameters of a query in the given paramstyle"""
+
+    def __init__(self, paramstyle):
+        self.placeholder = _placeholders[paramstyle]
+        self.named = paramstyle in ('named', 'pyformat')
+        if self.named:
+            self.values = {}
+        else:
+            self.values = []
+
+    def add(self, value):
+        """The placeholder of a new parameter holding value"""
+        n = len(self.values) + 1
+        if self.named:
+            self.values['p%d' % n] = value
+        else:
+            self.values.append(value)
+        return self.placeholder(n)
+
+def _where(attr, cond, params):
+    """The SQL condition for a where condition (see PivotSpec) on attr"""
+    column = _quote(attr)
+    if isinstance(cond, Range):
+        parts = ['%s IS NOT NULL' % column]
+        if cond.low is not None:
+            parts.append('%s >= %s' % (column, params.add(cond.low)))
+        if cond.high is not None:
+            parts.append('%s <= %s' % (column, params.add(cond.high)))
+        return '(%s)' % ' AND '.join(parts)
+    if isinstance(cond, In):
+        values = [v for v in cond.values if v is not None]
+        parts = []
+        if values:
+            parts.append('%s IN (%s)' % (column, ', '.join(params.add(v) for
+                                                           v in values)))
+        if len(values)<len(cond.values):
+            parts.append('%s IS NULL' % column)
+        return '(%s)' % (' OR '.join(parts) or '1=0')
+    if cond.value is None:
+        return '%s IS NULL' % column
+    return '%s = %s' % (column, params.add(cond.value))
@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+"""Binary storage for pivot results.
+
+A result saved with PivotTable.save is written column-wise in a compact binary
+file: a header with the shape of the table, the aggregated value of every cell
+(float64, NaN for empty cells) along with its kind (empty, int or float), the
+key and metric columns encoded as indexes into a table of distinct values, and
+that table itself (with the header rows and the metric labels). load_result
+maps the file in memory: opening it only reads the header and the value table,
+and every row is decoded when it is requested, so many short lived processes
+can reload a large result without pivotting or unpickling it again.
+"""
+import mmap
+import struct
+import sys
+from array import array
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .pivottable import PivotTableError, _dummy_formatter
+
+__all__ = ['save_result', 'load_result', 'StoredResult']
+
+MAGIC = b'PVT1'
+# magic, rows, key columns, cell columns, offset of the value table
+HEADER = struct.Struct('<4sIIIQ')
+# sections start at multiples of 8
+START = 32
+
+EMPTY, INT, FLOAT = 0, 1, 2
+
+def save_result(path, rows, labels, nk, nheaders=1, series=False):
+    """Write rows (an iterator like PivotTable.result, with raw cells: see
+    PivotSpec.render) to path. labels are the labels of the metrics, nk the
+    number of columns before the pivotted ones, nheaders the number of
+    header rows and series whether the metrics are side by side in every row
+    (see PivotTable.series) instead of one per row. Cells must be numbers or
+    None (integers are kept exact up to 2**53)"""
+    rows = iter(rows)
+    header_rows = [next(rows) for i in range(nheaders)]
+    headers = header_rows[-1]
+    values = array('d')
+    kinds = bytearray()
+    codes = array('i')
+    table = []
+    index = {}
+    nan = float('nan')
+    nrows = 0
+    for row in rows:
+        for v in row[:nk]:
+            try:
+                code = index[v]
+            except KeyError:
+                code = index[v] = len(table)
+                table.append(v)
+            codes.append(code)
+        for v in row[nk:]:
+            if v is None:
+                values.append(nan)
+                kinds.append(EMPTY)
+            elif isinstance(v, bool) or not isinstance(v, (int, float)):
+                raise PivotTableError("Only numeric cells can be saved: %r"
+                                      % (v,))
+            elif isinstance(v, float):
+                values.append(v)
+                kinds.append(FLOAT)
+            else:
+                values.append(v)
+                kinds.append(INT)
+        nrows += 1
+    ncells = len(headers) - nk
+    if sys.byteorder=='big':
+        values.byteswap()
+        codes.byteswap()
+    f = open(path, 'wb')
+    try:
+        offset = START
+        f.write(b'\0'*START)
+        for section, size in ((values, 8), (kinds, 1), (codes, 4)):
+            if isinstance(section, array):
+                section.tofile(f)
+            else:
+                f.write(section)
+            offset += len(section)*size
+            f.write(b'\0'*(-offset % 8))
+            offset += -offset % 8
+        pickle.dump((header_rows, list(labels), table, series), f,
+                    pickle.HIGHEST_PROTOCOL)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, nrows, nk, ncells, offset))
+    finally:
+        f.close()
+
+def load_result(path, formats=None):
+    """Open a result saved with PivotTable.save. formats maps metric labels to
+    the callable applied to their cells (metrics not in it are formatted as
+    PivotTable does by default)"""
+    return StoredResult(path, formats)
+
+class StoredResult(object):
+    """A saved result, mapped in memory. It reads like PivotTable.result (the
+    header rows come first) and also supports len() and indexing; rows are
+    decoded when they are requested. header_rows holds every header row and
+    headers the last one. Call close (or use it in a with statement) to
+    release the file"""
+
+    def __init__(self, path, formats=None):
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        magic, nrows, nk, ncells, offset = HEADER.unpack_from(self._mm, 0)
+        if magic!=MAGIC:
+            self.close()
+            raise PivotTableError("%s is not a saved pivot result" % path)
+        self._mm.seek(offset)
+        self.header_rows, self.labels, self._table, self._series = \
+            pickle.load(self._mm)
+        self.headers = self.header_rows[-1]
+        self.nrows = nrows
+        self._nk = nk
+        self._ncells = ncells
+        self._values = START
+        self._kinds = self._values + _aligned(nrows*ncells*8)
+        self._codes = self._kinds + _aligned(nrows*ncells)
+        self._values_fmt = struct.Struct('<%dd' % ncells)
+        self._codes_fmt = struct.Struct('<%di' % nk)
+        formats = formats or {}
+        self._formats = [formats.get(l, _dummy_formatter)
+                         for l in self.labels]
+
+    def __len__(self):
+        return self.nrows + len(self.header_rows)
+
+    def __iter__(self):
+        for h in self.header_rows:
+            yield list(h)
+        for i in range(self.nrows):
+            yield self._row(i)
+
+    def __getitem__(self, i):
+        nh = len(self.header_rows)
+        if i<0:
+            i += self.nrows + nh
+        if not 0<=i<self.nrows + nh:
+            raise IndexError(i)
+        if i<nh:
+            return list(self.header_rows[i])
+        return self._row(i - nh)
+
+    def _row(self, i):
+        mm = self._mm
+        table = self._table
+        row = [table[j] for j in
+               self._codes_fmt.unpack_from(mm, self._codes + i*4*self._nk)]
+        start = self._kinds + i*self._ncells
+        kinds = bytearray(mm[start:start + self._ncells])
+        values = self._values_fmt.unpack_from(mm, self._values +
+                                              i*8*self._ncells)
+        formats = self._formats
+        m = len(formats)
+        if self._series:
+            # the metric of every cell depends on its column
+            cycle = formats
+        else:
+            cycle = [formats[i % m]]
+        for j, v, kind in zip(range(len(values)), values, kinds):
+            if kind==EMPTY:
+                row.append(None)
+            elif kind==INT:
+                row.append(cycle[j % len(cycle)](int(v)))
+            else:
+                row.append(cycle[j % len(cycle)](v))
+        return row
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _aligned(size):
+    return size + (-size % 8)
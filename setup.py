@@ -25,4 +25,5 @@ setup(
     ],
     keywords = ['pivot', 'table', 'pivottable', 'python']
     ,install_requires=['ordereddict']
+    ,extras_require={'columnar': ['numpy']}
 )
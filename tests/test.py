@@ -1,12 +1,29 @@
 # -*- coding: UTF-8 -*-
 import datetime
+import json
+import os
+import sys
+import tempfile
+from itertools import islice
 from random import shuffle
 from nose.tools import eq_, raises, assert_raises
+from nose.plugins.skip import SkipTest
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from pivottable import (
-PivotTable, GroupBy, Sum
+PivotTable, PivotSpec, pivot_many, Rows, Stream, GroupBy, Count, Sum, Mean,
+Min, Max, load_result, Range, In
 )
 from pivottable.pivottable import PivotTableError
+from pivottable.export import write_csv, write_jsonl, write_html
+from pivottable.sql import SQLTable
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
 
 class TestError(Exception):
     pass
@@ -504,3 +521,1248 @@ class TestPivot_D(object):
             {'attr':'distro', 'label':'Distro', 'aggr':GroupBy})
         self.pt.headers
         all_ = [a for a in self.pt.result]
+
+class TestPivot_E(object):
+
+    pt = PivotTable()
+    pt.rows = [
+        GenericObject(**{'team':'B', 'year':2010, 'goals':3}),
+        GenericObject(**{'team':'Bz', 'year':2010, 'goals':1}),
+        GenericObject(**{'team':'Ba', 'year':2011, 'goals':2}),
+        GenericObject(**{'team':'B', 'year':2011, 'goals':4}),
+        GenericObject(**{'team':'Ba', 'year':2010, 'goals':5})
+    ]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    pt.yaxis_order = ["team"]
+
+    def test_EA_grouped_keys_are_sorted(self):
+        eq_([a for a in self.pt.result], [
+            ['team', 'metric', '2010', '2011'],
+            ['B', 'Goals', '3', '4'],
+            ['Ba', 'Goals', '5', '2'],
+            ['Bz', 'Goals', '1', None]])
+
+class TestPivot_F(object):
+
+    pt = PivotTable()
+    pt.rows = [
+        GenericObject(**{'team':'Boca', 'year':2010, 'goals':3}),
+        GenericObject(**{'team':'Boca', 'year':2010, 'goals':1}),
+        GenericObject(**{'team':'Boca', 'year':2010, 'goals':None}),
+        GenericObject(**{'team':'River', 'year':2010, 'goals':2}),
+        GenericObject(**{'team':'Boca', 'year':2011, 'goals':4}),
+        GenericObject(**{'team':'River', 'year':2011, 'goals':0}),
+        GenericObject(**{'team':'River', 'year':2011, 'goals':5})
+    ]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Total', 'aggr':Sum},
+        {'attr':'goals', 'label':'Matches', 'aggr':Count},
+        {'attr':'goals', 'label':'Average', 'aggr':Mean},
+        {'attr':'goals', 'label':'Worst', 'aggr':Min},
+        {'attr':'goals', 'label':'Best', 'aggr':Max}]
+    pt.yaxis_order = ["team"]
+
+    def test_FA_aggregations(self):
+        eq_([a for a in self.pt.result], [
+            ['team', 'metric', '2010', '2011'],
+            ['Boca', 'Total', '4', '4'],
+            ['Boca', 'Matches', '2', '1'],
+            ['Boca', 'Average', '2.0', '4.0'],
+            ['Boca', 'Worst', '1', '4'],
+            ['Boca', 'Best', '3', '4'],
+            ['River', 'Total', '2', '5'],
+            ['River', 'Matches', '1', '2'],
+            ['River', 'Average', '2.0', '2.5'],
+            ['River', 'Worst', '2', '0'],
+            ['River', 'Best', '2', '5']])
+
+    def test_FB_instances_do_not_share_state(self):
+        a, b = Sum(), Sum()
+        a.append(1)
+        a.append(2)
+        b.append(10)
+        eq_((a(), b()), (3, 10))
+        eq_(Sum()(), None)
+        eq_(Mean()(), None)
+
+class TestPivot_G(object):
+
+    pt = PivotTable()
+    pt.rows = [
+        GenericObject(**{'team':'Boca', 'year':2010, 'goals':3}),
+        GenericObject(**{'team':'River', 'year':2010, 'goals':2})
+    ]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    pt.yaxis_order = ["team"]
+
+    def test_GA_rows_are_observable(self):
+        assert isinstance(self.pt.rows, Rows)
+        eq_(self.pt.headers, ['team', 'metric', 2010])
+
+    def test_GB_append_updates_cache(self):
+        cache = self.pt._cache
+        self.pt.rows.append(GenericObject(**{'team':'Boca', 'year':2011,
+                                             'goals':1}))
+        self.pt.rows.extend([
+            GenericObject(**{'team':'Arsenal', 'year':2010, 'goals':4}),
+            GenericObject(**{'team':'Boca', 'year':2010, 'goals':2})])
+        eq_([a for a in self.pt.result], [
+            ['team', 'metric', '2010', '2011'],
+            ['Arsenal', 'Goals', '4', None],
+            ['Boca', 'Goals', '5', '1'],
+            ['River', 'Goals', '2', None]])
+        assert self.pt._cache is cache
+        eq_(cache.seen, 5)
+
+    def test_GC_other_changes_rebuild(self):
+        cache = self.pt._cache
+        del self.pt.rows[0]
+        eq_([a for a in self.pt.result], [
+            ['team', 'metric', '2010', '2011'],
+            ['Arsenal', 'Goals', '4', None],
+            ['Boca', 'Goals', '2', '1'],
+            ['River', 'Goals', '2', None]])
+        assert self.pt._cache is not cache
+        cache = self.pt._cache
+        self.pt.yaxis[1]['aggr'] = Count
+        eq_([a for a in self.pt.result][2], ['Boca', 'Goals', '1', '1'])
+        assert self.pt._cache is not cache
+
+class TestPivot_H(object):
+
+    data = [
+        ('Boca', 'A', 2010, 3, 1.5),
+        ('Boca', 'A', 2010, 1, float('nan')),
+        ('River', 'A', 2011, 2, 0.5),
+        ('Boca', 'B', 2011, 4, 2.0),
+        ('River', 'A', 2011, 5, 1.0),
+        ('Arsenal', 'B', 2010, 0, 3.0)]
+    yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'division', 'label':'Division', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum},
+        {'attr':'goals', 'label':'Best', 'aggr':Max},
+        {'attr':'rating', 'label':'Rating', 'aggr':Mean},
+        {'attr':'rating', 'label':'Rated', 'aggr':Count}]
+    expected = [
+        ['division', 'team', 'metric', '2010', '2011'],
+        ['A', 'Boca', 'Goals', '4', None],
+        ['A', 'Boca', 'Best', '3', None],
+        ['A', 'Boca', 'Rating', '1.5', None],
+        ['A', 'Boca', 'Rated', '1', None],
+        ['A', 'River', 'Goals', None, '7'],
+        ['A', 'River', 'Best', None, '5'],
+        ['A', 'River', 'Rating', None, '0.75'],
+        ['A', 'River', 'Rated', None, '2'],
+        ['B', 'Arsenal', 'Goals', '0', None],
+        ['B', 'Arsenal', 'Best', '0', None],
+        ['B', 'Arsenal', 'Rating', '3.0', None],
+        ['B', 'Arsenal', 'Rated', '1', None],
+        ['B', 'Boca', 'Goals', None, '4'],
+        ['B', 'Boca', 'Best', None, '4'],
+        ['B', 'Boca', 'Rating', None, '2.0'],
+        ['B', 'Boca', 'Rated', None, '1']]
+
+    def _pivot(self, rows):
+        pt = PivotTable()
+        pt.rows = rows
+        pt.xaxis = "year"
+        pt.yaxis = self.yaxis
+        pt.yaxis_order = ['division', 'team']
+        return [a for a in pt.result]
+
+    def test_HA_structured_array(self):
+        if numpy is None:
+            raise SkipTest
+        rows = numpy.array(self.data, dtype=[
+            ('team', 'U10'), ('division', 'U1'), ('year', 'i4'),
+            ('goals', 'i8'), ('rating', 'f8')])
+        eq_(self._pivot(rows), self.expected)
+
+    def test_HB_dict_of_arrays(self):
+        if numpy is None:
+            raise SkipTest
+        names = ['team', 'division', 'year', 'goals', 'rating']
+        rows = dict((n, [d[i] for d in self.data]) for i, n in
+                    enumerate(names))
+        eq_(self._pivot(rows), self.expected)
+
+    def test_HC_wrong_columns(self):
+        if numpy is None:
+            raise SkipTest
+        pt = PivotTable()
+        assert_raises(PivotTableError, setattr, pt, 'rows',
+                      {'a':[1, 2], 'b':[1]})
+        pt.rows = {'a':[1, 2], 'b':[1, 2]}
+        assert_raises(PivotTableError, setattr, pt, 'xaxis', 'c')
+
+    def test_HD_sparse_grid(self):
+        if numpy is None:
+            raise SkipTest
+        # every team plays a single year: far fewer cells than the grid
+        data = [('Team %d' % i, 'AB'[i % 2], 2000 + i, i, i / 2.0)
+                for i in range(8)]
+        names = ['team', 'division', 'year', 'goals', 'rating']
+        rows = dict((n, numpy.array([d[i] for d in data])) for i, n in
+                    enumerate(names))
+        self.yaxis = self.yaxis + [
+            {'attr':'division', 'label':'Last', 'aggr':Max}]
+        eq_(self._pivot(rows),
+            self._pivot([GenericObject(**dict(zip(names, d)))
+                         for d in data]))
+
+class TestPivot_I(object):
+
+    def _rows(self):
+        for i in range(100):
+            yield GenericObject(**{'team':'Team %d' % (i % 3),
+                                   'year':2010 + i % 2, 'goals':i})
+
+    def test_IA_generator(self):
+        pt = PivotTable()
+        pt.rows = self._rows()
+        assert isinstance(pt.rows, Stream)
+        pt.xaxis = "year"
+        pt.yaxis = [
+            {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+            {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+        pt.yaxis_order = ["team"]
+        eq_(pt.headers, ['team', 'metric', 2010, 2011])
+        eq_([a for a in pt.result], [
+            ['team', 'metric', '2010', '2011'],
+            ['Team 0', 'Goals', '816', '867'],
+            ['Team 1', 'Goals', '784', '833'],
+            ['Team 2', 'Goals', '850', '800']])
+        eq_(pt._cache.seen, 100)
+        # the rows are gone: the definition cannot change anymore
+        pt.yaxis[1]['aggr'] = Count
+        assert_raises(PivotTableError, getattr, pt, 'result')
+
+class TestPivot_J(object):
+
+    pt = PivotTable()
+    pt.rows = [
+        GenericObject(**{'city':'Buenos Aires', 'team':'Boca', 'year':2010,
+                         'goals':3}),
+        GenericObject(**{'city':'Buenos Aires', 'team':'Boca', 'year':2011,
+                         'goals':1}),
+        GenericObject(**{'city':'Buenos Aires', 'team':'River', 'year':2010,
+                         'goals':2}),
+        GenericObject(**{'city':'La Plata', 'team':'Estudiantes',
+                         'year':2011, 'goals':4}),
+        GenericObject(**{'city':'La Plata', 'team':'Gimnasia', 'year':2011,
+                         'goals':0})
+    ]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'city', 'label':'City', 'aggr':GroupBy},
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum},
+        {'attr':'goals', 'label':'Average', 'aggr':Mean}]
+    pt.yaxis_order = ['city', 'team']
+
+    def test_JA_subtotals(self):
+        self.pt.calculate_subtotals = True
+        eq_([a for a in self.pt.result], [
+            ['city', 'team', 'metric', '2010', '2011'],
+            ['Buenos Aires', 'Boca', 'Goals', '3', '1'],
+            ['Buenos Aires', 'Boca', 'Average', '3.0', '1.0'],
+            ['Buenos Aires', 'River', 'Goals', '2', None],
+            ['Buenos Aires', 'River', 'Average', '2.0', None],
+            ['Buenos Aires', 'Subtotal', 'Goals', '5', '1'],
+            ['Buenos Aires', 'Subtotal', 'Average', '2.5', '1.0'],
+            ['La Plata', 'Estudiantes', 'Goals', None, '4'],
+            ['La Plata', 'Estudiantes', 'Average', None, '4.0'],
+            ['La Plata', 'Gimnasia', 'Goals', None, '0'],
+            ['La Plata', 'Gimnasia', 'Average', None, '0.0'],
+            ['La Plata', 'Subtotal', 'Goals', None, '4'],
+            ['La Plata', 'Subtotal', 'Average', None, '2.0']])
+
+    def test_JB_totals(self):
+        self.pt.calculate_subtotals = False
+        self.pt.calculate_totals = True
+        self.pt.total_label = 'All'
+        eq_(self.pt.headers, ['city', 'team', 'metric', 2010, 2011, 'All'])
+        eq_([a for a in self.pt.result], [
+            ['city', 'team', 'metric', '2010', '2011', 'All'],
+            ['Buenos Aires', 'Boca', 'Goals', '3', '1', '4'],
+            ['Buenos Aires', 'Boca', 'Average', '3.0', '1.0', '2.0'],
+            ['Buenos Aires', 'River', 'Goals', '2', None, '2'],
+            ['Buenos Aires', 'River', 'Average', '2.0', None, '2.0'],
+            ['La Plata', 'Estudiantes', 'Goals', None, '4', '4'],
+            ['La Plata', 'Estudiantes', 'Average', None, '4.0', '4.0'],
+            ['La Plata', 'Gimnasia', 'Goals', None, '0', '0'],
+            ['La Plata', 'Gimnasia', 'Average', None, '0.0', '0.0'],
+            ['All', None, 'Goals', '5', '5', '10'],
+            ['All', None, 'Average', '2.5', '1.6666666666666667', '2.0']])
+
+class TestPivot_K(object):
+
+    spec = PivotSpec("year", [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}], ["team"])
+
+    def test_KA_apply_to_many_datasets(self):
+        eq_([a for a in self.spec.apply([
+                GenericObject(**{'team':'Boca', 'year':2010, 'goals':3}),
+                GenericObject(**{'team':'Boca', 'year':2010, 'goals':1})])],
+            [['team', 'metric', '2010'], ['Boca', 'Goals', '4']])
+        eq_([a for a in self.spec.apply(
+                GenericObject(**{'team':t, 'year':2011, 'goals':2}) for t in
+                ['River', 'Arsenal'])],
+            [['team', 'metric', '2011'], ['Arsenal', 'Goals', '2'],
+             ['River', 'Goals', '2']])
+
+    def test_KB_validation(self):
+        assert_raises(PivotTableError, PivotSpec, None, [])
+        assert_raises(PivotTableError, PivotSpec, "year",
+                      [{'attr':'team', 'label':'Team'}])
+        assert_raises(PivotTableError, PivotSpec, "year",
+                      [{'attr':'goals', 'label':'Goals', 'aggr':Sum}],
+                      ["goals"])
+
+    def test_KC_table_spec(self):
+        pt = PivotTable()
+        pt.xaxis = "year"
+        pt.yaxis = [{'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+        eq_(pt.spec.sig, ("year", (), (('goals', Sum),), (), True))
+
+class TestPivot_L(object):
+
+    rows = [GenericObject(**{'team':'Team %d' % (i % 7), 'city':i % 3,
+                             'year':2000 + i % 5, 'goals':i % 4})
+            for i in range(200)]
+    yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'city', 'label':'City', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum},
+        {'attr':'goals', 'label':'Average', 'aggr':Mean},
+        {'attr':'goals', 'label':'Best', 'aggr':Max}]
+
+    def _pivot(self, workers):
+        pt = PivotTable()
+        pt.rows = self.rows
+        pt.xaxis = "year"
+        pt.xaxis_sort = False
+        pt.yaxis = self.yaxis
+        pt.yaxis_order = ['city', 'team']
+        pt.workers = workers
+        pt.chunksize = 15
+        return pt
+
+    def test_LA_parallel_matches_serial(self):
+        pt = self._pivot(2)
+        eq_([a for a in pt.result], [a for a in self._pivot(None).result])
+        eq_(pt._cache.seen, 200)
+        pt.rows.append(GenericObject(**{'team':'Team 9', 'city':0,
+                                        'year':1999, 'goals':1}))
+        serial = self._pivot(None)
+        serial.rows.append(pt.rows[-1])
+        eq_([a for a in pt.result], [a for a in serial.result])
+
+    def test_LB_parallel_where(self):
+        where = {'city':1, 'year':In([2000, 2003]), 'goals':Range(1)}
+        pt = self._pivot(2)
+        pt.where = where
+        serial = self._pivot(None)
+        serial.where = where
+        expected = [a for a in serial.result]
+        eq_(len(expected), 22)
+        eq_([a for a in pt.result], expected)
+
+class TestPivot_M(object):
+
+    def _table(self, n):
+        return PivotTable(
+            rows=[GenericObject(**{'team':'Team %d' % (i % n), 'year':2010,
+                                   'goals':i}) for i in range(10 * n)],
+            xaxis="year",
+            yaxis=[{'attr':'team', 'label':'Team', 'aggr':GroupBy},
+                   {'attr':'goals', 'label':'Goals', 'aggr':Sum}],
+            yaxis_order=['team'])
+
+    def test_MA_instances_do_not_share_state(self):
+        a, b = PivotTable(), PivotTable()
+        a.rows.append(GenericObject(**{'year':2010}))
+        eq_(len(b.rows), 0)
+        a.yaxis_order.append('team')
+        eq_(b.yaxis_order, [])
+        eq_(PivotTable.yaxis_order, ())
+        assert '_rows' not in vars(PivotTable)
+
+    def test_MC_unknown_keywords(self):
+        for kw in ({'calculate_total':True}, {'_cache':None},
+                   {'result':[]}, {'invalidate':None}):
+            assert_raises(PivotTableError, PivotTable, **kw)
+        eq_(PivotTable(calculate_totals=True).calculate_totals, True)
+
+    def test_MB_pivot_many(self):
+        tables = [self._table(n) for n in range(1, 6)]
+        done = dict((id(t), r) for t, r in pivot_many(tables, 3))
+        for t in tables:
+            eq_(done[id(t)], [a for a in t.result])
+        eq_(len(done[id(tables[2])]), 4)
+
+class TestPivot_N(object):
+
+    pt = PivotTable()
+    pt.rows = [
+        GenericObject(**{'city':'Buenos Aires', 'team':'Boca', 'year':2010,
+                         'goals':3}),
+        GenericObject(**{'city':'Buenos Aires', 'team':'River', 'year':2011,
+                         'goals':2}),
+        GenericObject(**{'city':'La Plata', 'team':'Gimnasia', 'year':2012,
+                         'goals':1})]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'city', 'label':'City', 'aggr':GroupBy},
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    pt.yaxis_order = ['city', 'team']
+
+    def test_NA_only_populated_cells(self):
+        sparse = self.pt.sparse_result
+        eq_(sparse.headers, ['city', 'team', 'metric', '2010', '2011', '2012'])
+        eq_(len(sparse), 3)
+        eq_([(r.kind, r.head, r.cells) for r in sparse], [
+            ('row', ['Buenos Aires', 'Boca', 'Goals'], {3:'3'}),
+            ('row', ['Buenos Aires', 'River', 'Goals'], {4:'2'}),
+            ('row', ['La Plata', 'Gimnasia', 'Goals'], {5:'1'})])
+        eq_(list(sparse.coordinates()), [(0, 3, '3'), (1, 4, '2'),
+                                         (2, 5, '1')])
+
+    def test_NB_densify_matches_result(self):
+        self.pt.calculate_subtotals = True
+        self.pt.calculate_totals = True
+        sparse = self.pt.sparse_result
+        eq_(list(sparse.densify()), list(self.pt.result))
+        eq_([r.kind for r in sparse], ['row', 'row', 'subtotal', 'row',
+                                       'subtotal', 'total'])
+
+class TestPivot_O(object):
+
+    rows = [GenericObject(**{'city':'City %d' % (i % 7),
+                             'team':'Team %d' % (i % 1000),
+                             'year':2010 + i % 3, 'goals':i % 5})
+            for i in range(10000)]
+    pt = PivotTable()
+    pt.rows = rows
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'city', 'label':'City', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum},
+        {'attr':'goals', 'label':'Average', 'aggr':Mean}]
+    pt.yaxis_order = ['city', 'team']
+    pt.calculate_subtotals = True
+    pt.calculate_totals = True
+
+    def test_OA_spilled_runs_match_memory(self):
+        expected = list(self.pt.result)
+        self.pt.memory_limit = 1
+        self.pt.invalidate()
+        eq_(list(self.pt.result), expected)
+        # the groups were spilled three times, once every 4096 rows
+        eq_(len(self.pt._cache.runs), 3)
+        eq_(list(self.pt.result), expected)
+
+    def test_OB_append_after_spilling(self):
+        self.pt.memory_limit = 1
+        self.pt.rows = self.rows[:5000]
+        list(self.pt.result)
+        self.pt.rows.extend(self.rows[5000:])
+        spilled = list(self.pt.result)
+        self.pt.memory_limit = None
+        self.pt.invalidate()
+        eq_(spilled, list(self.pt.result))
+
+    def test_OC_stream(self):
+        self.pt.memory_limit = None
+        self.pt.rows = self.rows
+        expected = list(self.pt.result)
+        self.pt.memory_limit = 1
+        self.pt.rows = iter(self.rows)
+        eq_(list(self.pt.result), expected)
+
+class TestPivot_P(object):
+
+    pt = PivotTable()
+    pt.rows = [
+        GenericObject(**{'city':'Buenos Aires', 'team':'Boca', 'year':2010,
+                         'goals':3}),
+        GenericObject(**{'city':'Buenos Aires', 'team':'River', 'year':2011,
+                         'goals':2}),
+        GenericObject(**{'city':'La Plata', 'team':'Gimnasia', 'year':2011,
+                         'goals':1})]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'city', 'label':'City', 'aggr':GroupBy},
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum},
+        {'attr':'goals', 'label':'Average', 'aggr':Mean,
+         'format':lambda v: '%.2f' % v}]
+    pt.yaxis_order = ['city', 'team']
+
+    def _load(self, pt, formats=None):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            pt.save(path)
+            stored = load_result(path, formats)
+            try:
+                return list(stored), stored[1], stored[-1], len(stored)
+            finally:
+                stored.close()
+        finally:
+            os.remove(path)
+
+    def test_PA_save_and_load(self):
+        self.pt.calculate_subtotals = True
+        self.pt.calculate_totals = True
+        rows, first, last, length = self._load(
+            self.pt, {'Average':lambda v: '%.2f' % v})
+        eq_(rows, list(self.pt.result))
+        eq_(length, 13)
+        eq_(first, ['Buenos Aires', 'Boca', 'Goals', '3', None, '3'])
+        eq_(last, ['Total', None, 'Average', '3.00', '1.50', '2.00'])
+
+    def test_PB_raw_values_are_kept(self):
+        self.pt.calculate_totals = False
+        rows = self._load(self.pt, {'Goals':repr, 'Average':repr})[0]
+        eq_(rows[2], ['Buenos Aires', 'Boca', 'Average', '3.0', None])
+
+    def test_PC_only_numbers(self):
+        self.pt.yaxis = [{'attr':'city', 'label':'City', 'aggr':GroupBy},
+                         {'attr':'team', 'label':'Team', 'aggr':Max}]
+        assert_raises(PivotTableError, self._load, self.pt)
+
+class TestPivot_Q(object):
+
+    pt = PivotTable()
+    pt.rows = [
+        GenericObject(**{'city':'Buenos Aires', 'team':'Boca', 'year':2010,
+                         'goals':3}),
+        GenericObject(**{'city':'Buenos Aires', 'team':'River', 'year':2011,
+                         'goals':2}),
+        GenericObject(**{'city':'La Plata', 'team':'Gimnasia & Esgrima',
+                         'year':2011, 'goals':1})]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'city', 'label':'City', 'aggr':GroupBy},
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    pt.yaxis_order = ['city', 'team']
+    pt.calculate_subtotals = True
+
+    composite = PivotTable()
+    composite.rows = [
+        GenericObject(**{'team':'Boca', 'year':2010, 'region':'North',
+                         'goals':3}),
+        GenericObject(**{'team':'Boca', 'year':2010, 'region':'South',
+                         'goals':4}),
+        GenericObject(**{'team':'River', 'year':2011, 'region':'North',
+                         'goals':2})]
+    composite.xaxis = ['year', 'region']
+    composite.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    composite.yaxis_order = ['team']
+    composite.calculate_totals = True
+
+    def test_QA_csv(self):
+        f = StringIO()
+        write_csv(self.pt, f, chunksize=2, lineterminator='\n')
+        eq_(f.getvalue(),
+            'city,team,metric,2010,2011\n'
+            'Buenos Aires,Boca,Goals,3,\n'
+            'Buenos Aires,River,Goals,,2\n'
+            'Buenos Aires,Subtotal,Goals,3,2\n'
+            'La Plata,Gimnasia & Esgrima,Goals,,1\n'
+            'La Plata,Subtotal,Goals,,1\n')
+
+    def test_QB_jsonl(self):
+        f = StringIO()
+        write_jsonl(self.pt.result, f, chunksize=2)
+        eq_([json.loads(l) for l in f.getvalue().splitlines()],
+            [a for a in self.pt.result])
+        f = StringIO()
+        write_jsonl(self.pt, f, records=True)
+        eq_(json.loads(f.getvalue().splitlines()[0]),
+            {'city':'Buenos Aires', 'team':'Boca', 'metric':'Goals',
+             '2010':'3', '2011':None})
+
+    def test_QC_html(self):
+        f = StringIO()
+        write_html(self.pt, f, chunksize=1, table_class='report')
+        html = f.getvalue()
+        assert html.startswith('<table class="report">\n<thead>\n<tr>'
+                               '<th>city</th>')
+        eq_(html.count('<tr class="subtotal">'), 2)
+        assert '<td>Gimnasia &amp; Esgrima</td>' in html
+        assert html.endswith('</tbody>\n</table>\n')
+        f = StringIO()
+        write_html(self.pt, f,
+                   row_class=lambda kind, row: row[0]=='La Plata' and 'lp')
+        eq_(f.getvalue().count('<tr class="lp">'), 2)
+
+    def test_QD_composite_records(self):
+        pt = self.composite
+        expected = [{'team':'Boca', 'metric':'Goals', '2010/North':'3',
+                     '2010/South':'4', '2011/North':None, 'Total':'7'},
+                    {'team':'River', 'metric':'Goals', '2010/North':None,
+                     '2010/South':None, '2011/North':'2', 'Total':'2'}]
+        for source, kw in ((pt, {}), (pt.result, {'nheaders':2})):
+            f = StringIO()
+            write_jsonl(source, f, records=True, **kw)
+            eq_([json.loads(l) for l in f.getvalue().splitlines()][:2],
+                expected)
+        f = StringIO()
+        write_jsonl(pt, f, records=True, separator=' ')
+        assert '"2010 North": "3"' in f.getvalue()
+
+    def test_QE_header_rows_of_iterables(self):
+        pt = self.composite
+        f = StringIO()
+        write_html(pt.result, f, nheaders=2)
+        head, body = f.getvalue().split('</thead>')
+        eq_(head.count('<tr>'), 2)
+        assert '<th>team</th>' in head and 'team' not in body
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            pt.save(path)
+            stored = load_result(path)
+            f = StringIO()
+            write_csv(stored, f, lineterminator='\n')
+            stored.close()
+        finally:
+            os.remove(path)
+        eq_(f.getvalue().splitlines()[:3], [
+            ',,2010,2010,2011,', 'team,metric,North,South,North,Total',
+            'Boca,Goals,3,4,,7'])
+
+class TestPivot_R(object):
+
+    pt = PivotTable()
+    pt.rows = [
+        GenericObject(**{'team':'Boca', 'year':2010, 'goals':3}),
+        GenericObject(**{'team':'Boca', 'year':2011, 'goals':1}),
+        GenericObject(**{'team':'River', 'year':2010, 'goals':2}),
+        GenericObject(**{'team':'Boca', 'year':2010, 'goals':4})]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum},
+        {'attr':'goals', 'label':'Average', 'aggr':Mean}]
+    pt.yaxis_order = ['team']
+
+    def test_RA_not_instrumented_by_default(self):
+        list(self.pt.result)
+        eq_(self.pt.stats, None)
+
+    def test_RB_counters(self):
+        reports = []
+        self.pt.stats_hook = reports.append
+        self.pt.calculate_totals = True
+        self.pt.invalidate()
+        rows = list(self.pt.result)
+        eq_(len(reports), 1)
+        stats = reports[0]
+        assert self.pt.stats is stats
+        eq_((stats.rows, stats.keys, stats.xvalues, stats.cells,
+             stats.format_calls), (4, 2, 2, 16, 16))
+        for phase in ('aggregate', 'getattr', 'sort', 'headers', 'render',
+                      'format'):
+            assert stats.timers[phase]>=0
+        eq_(stats.as_dict()['cells'], 16)
+        # cached reads scan no rows
+        self.pt.headers
+        eq_(self.pt.stats.rows, 0)
+        eq_(len(reports), 2)
+
+    def test_RC_lazy_reads_report_when_exhausted(self):
+        self.pt.stats_hook = None
+        self.pt.calculate_totals = False
+        self.pt.instrument = True
+        before = self.pt.stats
+        rows = self.pt.iter_rows()
+        next(rows)
+        assert self.pt.stats is before
+        list(rows)
+        eq_(self.pt.stats.cells, 6)
+
+class TestPivot_S(object):
+
+    # the values formatted by fmt
+    calls = []
+
+    def fmt(value, calls=calls):
+        calls.append(value)
+        return '%.1f' % value
+
+    pt = PivotTable()
+    pt.rows = [GenericObject(**{'team':'Team %d' % (i % 10),
+                                'year':2010 + i // 20, 'goals':i % 3})
+               for i in range(40)]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum, 'format':fmt}]
+    pt.yaxis_order = ['team']
+
+    def test_SA_raw_result(self):
+        rows = list(self.pt.raw_result)
+        eq_(rows[0], ['team', 'metric', '2010', '2011'])
+        eq_(rows[1], ['Team 0', 'Goals', 1, 2])
+
+    def test_SB_lazy_formats_what_is_read(self):
+        self.pt.lazy = True
+        del self.calls[:]
+        page = list(islice(self.pt.result, 1, 3))
+        eq_(page, [['Team 0', 'Goals', '1.0', '2.0'],
+                   ['Team 1', 'Goals', '3.0', '1.0']])
+        eq_(len(self.calls), 4)
+
+    def test_SC_format_cache(self):
+        self.pt.lazy = False
+        expected = list(self.pt.result)
+        self.pt.format_cache = 16
+        del self.calls[:]
+        eq_(list(self.pt.result), expected)
+        # only the distinct sums are formatted
+        eq_(sorted(self.calls), [1, 2, 3])
+        eq_(list(self.pt.result), expected)
+        eq_(len(self.calls), 6)
+
+class TestPivot_T(object):
+
+    data = [('Boca', 2010, 'H1', 3), ('Boca', 2010, 'H2', 1),
+            ('River', 2011, 'H1', 2), ('Boca', 2011, 'H1', 4),
+            ('River', 2010, 'H2', 5)]
+    pt = PivotTable()
+    pt.rows = [GenericObject(**{'team':t, 'year':y, 'half':h, 'goals':g})
+               for t, y, h, g in data]
+    pt.xaxis = ['year', 'half']
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    pt.yaxis_order = ['team']
+    pt.calculate_totals = True
+
+    def test_TA_composite_columns(self):
+        eq_(self.pt.headers, ['team', 'metric', (2010, 'H1'), (2010, 'H2'),
+                              (2011, 'H1'), 'Total'])
+        eq_([a for a in self.pt.result], [
+            [None, None, '2010', '2010', '2011', None],
+            ['team', 'metric', 'H1', 'H2', 'H1', 'Total'],
+            ['Boca', 'Goals', '3', '1', '4', '8'],
+            ['River', 'Goals', None, '5', '2', '7'],
+            ['Total', 'Goals', '3', '6', '6', '15']])
+        eq_([k for k, r in self.pt.iter_rows()][:3],
+            ['header', 'header', 'row'])
+
+    def test_TB_unknown_attribute(self):
+        assert_raises(PivotTableError, setattr, self.pt, 'xaxis',
+                      ['year', 'month'])
+
+    def test_TC_columnar(self):
+        if numpy is None:
+            raise SkipTest("numpy is not installed")
+        expected = [a for a in self.pt.result]
+        self.pt.rows = dict(zip(['team', 'year', 'half', 'goals'],
+                                [numpy.array(c) for c in zip(*self.data)]))
+        eq_([a for a in self.pt.result], expected)
+
+class TestPivot_U(object):
+
+    pt = PivotTable()
+    pt.rows = [GenericObject(**{'account':a, 'month':m, 'actual':r,
+                                'target':t, 'variance':r - t})
+               for a, m, r, t in [('Sales', 'jan', 10, 12),
+                                  ('Sales', 'feb', 14, 12),
+                                  ('Costs', 'jan', 5, 4),
+                                  ('Sales', 'jan', 3, 1)]]
+    pt.xaxis = "month"
+    pt.yaxis = [
+        {'attr':'account', 'label':'Account', 'aggr':GroupBy},
+        {'attr':'actual', 'label':'Actual', 'aggr':Sum},
+        {'attr':'target', 'label':'Target', 'aggr':Sum},
+        {'attr':'variance', 'label':'Var', 'aggr':Sum}]
+    pt.yaxis_order = ['account']
+    pt.series = True
+
+    def test_UA_series_side_by_side(self):
+        self.pt.calculate_totals = True
+        eq_(self.pt.headers[:3],
+            ['account', ('feb', 'Actual'), ('feb', 'Target')])
+        eq_([a for a in self.pt.result], [
+            [None, 'feb', 'feb', 'feb', 'jan', 'jan', 'jan', 'Total',
+             'Total', 'Total'],
+            ['account', 'Actual', 'Target', 'Var', 'Actual', 'Target', 'Var',
+             'Actual', 'Target', 'Var'],
+            ['Costs', None, None, None, '5', '4', '1', '5', '4', '1'],
+            ['Sales', '14', '12', '2', '13', '13', '0', '27', '25', '2'],
+            ['Total', '14', '12', '2', '18', '17', '1', '32', '29', '3']])
+
+    def test_UB_composite_xaxis(self):
+        self.pt.calculate_totals = False
+        self.pt.xaxis = ['month', 'account']
+        self.pt.yaxis_order = []
+        eq_([a for a in self.pt.result][:3], [
+            [None, 'feb', 'feb', 'feb', 'jan', 'jan', 'jan', 'jan', 'jan',
+             'jan'],
+            [None, 'Sales', 'Sales', 'Sales', 'Costs', 'Costs', 'Costs',
+             'Sales', 'Sales', 'Sales'],
+            ['account', 'Actual', 'Target', 'Var', 'Actual', 'Target', 'Var',
+             'Actual', 'Target', 'Var']])
+        # back to the accounts as rows for the next tests
+        self.pt.xaxis = "month"
+        self.pt.yaxis_order = ['account']
+
+    def test_UC_sparse_and_stored(self):
+        self.pt.calculate_totals = False
+        self.pt.calculate_subtotals = True
+        pt = self.pt
+        eq_(list(pt.sparse_result.densify()), list(pt.result))
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            pt.save(path)
+            stored = load_result(path, {'Var':lambda v: '%+d' % v})
+            rows = list(stored)
+            stored.close()
+        finally:
+            os.remove(path)
+        eq_(rows[2], ['Costs', None, None, None, '5', '4', '+1'])
+
+    def test_UD_exported_records(self):
+        self.pt.calculate_totals = True
+        pt = self.pt
+        f = StringIO()
+        write_jsonl(pt, f, records=True)
+        eq_(json.loads(f.getvalue().splitlines()[1]),
+            {'account':'Sales', 'feb/Actual':'14', 'feb/Target':'12',
+             'feb/Var':'2', 'jan/Actual':'13', 'jan/Target':'13',
+             'jan/Var':'0', 'Total/Actual':'27', 'Total/Target':'25',
+             'Total/Var':'2'})
+        f = StringIO()
+        write_csv(pt.result, f, nheaders=2, lineterminator='\n')
+        eq_(f.getvalue().splitlines()[2], 'Costs,,,,5,4,1,5,4,1')
+
+class TestPivot_V(object):
+
+    pt = PivotTable()
+    pt.rows = [GenericObject(**{'team':'Team %02d' % (i % 20),
+                                'year':2010 + i % 2, 'goals':i})
+               for i in range(100)]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum},
+        {'attr':'goals', 'label':'Best', 'aggr':Max}]
+    pt.yaxis_order = ['team']
+
+    def test_VA_window(self):
+        pt = self.pt
+        pt.calculate_totals = True
+        rows = [a for a in pt.result]
+        eq_([a for a in pt.window(5, 10)], rows[:1] + rows[6:16])
+        eq_([a for a in pt.window(39)], rows[:1] + rows[40:])
+        eq_([a for a in pt.window(0, 0)], rows[:1])
+        assert_raises(PivotTableError, pt.window, -1)
+
+    def test_VB_window_formats_only_the_window(self):
+        calls = []
+        def fmt(value):
+            calls.append(value)
+            return str(value)
+        self.pt.calculate_totals = False
+        self.pt.yaxis[1]['format'] = fmt
+        try:
+            eq_(len([a for a in self.pt.window(10, 4)]), 5)
+        finally:
+            del self.pt.yaxis[1]['format']
+        # two rows of Goals, every team scores in a single year
+        eq_(len(calls), 2)
+
+    def test_VC_top(self):
+        pt = self.pt
+        pt.calculate_totals = False
+        eq_([a for a in pt.top(2, 'Goals')], [
+            ['team', 'metric', '2010', '2011'],
+            ['Team 19', 'Goals', None, '295'],
+            ['Team 19', 'Best', None, '99'],
+            ['Team 18', 'Goals', '290', None],
+            ['Team 18', 'Best', '98', None]])
+        eq_([a[0] for a in pt.top(3, 'Goals', 2010, largest=False)][1::2],
+            ['Team 00', 'Team 02', 'Team 04'])
+        assert_raises(PivotTableError, pt.top, 2, 'Assists')
+
+class CountedRow(object):
+    """A row that counts how many times its team is read"""
+
+    reads = 0
+
+    def __init__(self, region, team, year, goals):
+        self.region = region
+        self._team = team
+        self.year = year
+        self.goals = goals
+
+    @property
+    def team(self):
+        CountedRow.reads += 1
+        return self._team
+
+class TestPivot_W(object):
+
+    data = [('North', 'Boca', 2010, 3), ('North', 'River', 2011, 2),
+            ('South', 'Boca', 2011, 4), ('South', 'Racing', 2012, 1),
+            ('East', 'Boca', 2012, 5)]
+    pt = PivotTable()
+    pt.rows = [CountedRow(*d) for d in data]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    pt.yaxis_order = ['team']
+
+    def test_WA_conditions(self):
+        pt = self.pt
+        pt.where = {'region':'North'}
+        eq_([a for a in pt.result], [
+            ['team', 'metric', '2010', '2011'],
+            ['Boca', 'Goals', '3', None],
+            ['River', 'Goals', None, '2']])
+        pt.where = {'year':Range(2011), 'region':In(['South', 'East'])}
+        eq_([a for a in pt.result], [
+            ['team', 'metric', '2011', '2012'],
+            ['Boca', 'Goals', '4', '5'],
+            ['Racing', 'Goals', None, '1']])
+        pt.where = {'year':Range(None, 2010)}
+        eq_([a for a in pt.result][1:], [['Boca', 'Goals', '3']])
+        eq_(repr(In(['South', None])), "In(['South', None])")
+
+    def test_WB_index_skips_rows(self):
+        rows = Rows([CountedRow(*d) for d in self.data])
+        rows.add_index('region')
+        self.pt.rows = rows
+        self.pt.where = {'region':In(['South'])}
+        CountedRow.reads = 0
+        eq_([a[0] for a in self.pt.result][1:], ['Boca', 'Racing'])
+        eq_(CountedRow.reads, 2)
+        rows.append(CountedRow('South', 'Velez', 2010, 2))
+        rows.append(CountedRow('West', 'Lanus', 2010, 2))
+        eq_([a[0] for a in self.pt.result][1:], ['Boca', 'Racing', 'Velez'])
+        eq_(CountedRow.reads, 3)
+
+    def test_WC_columnar(self):
+        if numpy is None:
+            raise SkipTest("numpy is not installed")
+        self.pt.rows = [CountedRow(*d) for d in self.data]
+        self.pt.where = {'year':Range(2011), 'region':In(['South', 'East'])}
+        expected = [a for a in self.pt.result]
+        self.pt.rows = dict(zip(['region', 'team', 'year', 'goals'],
+                                [numpy.array(c) for c in zip(*self.data)]))
+        eq_([a for a in self.pt.result], expected)
+
+class TestPivot_X(object):
+
+    data = TestPivot_W.data + [('North', 'Boca', 2010, 7),
+                               ('South', 'River', 2012, None)]
+    pt = PivotTable()
+    pt.rows = [CountedRow(*d) for d in data]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'region', 'label':'Region', 'aggr':GroupBy},
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum},
+        {'attr':'goals', 'label':'Mean', 'aggr':Mean},
+        {'attr':'goals', 'label':'Max', 'aggr':Max},
+        {'attr':'goals', 'label':'Count', 'aggr':Count}]
+    pt.yaxis_order = ['region', 'team']
+    pt.calculate_totals = True
+    pt.calculate_subtotals = True
+
+    def _db(self):
+        import sqlite3
+        db = sqlite3.connect(':memory:')
+        db.execute('CREATE TABLE goals (region, team, year, goals)')
+        db.executemany('INSERT INTO goals VALUES (?, ?, ?, ?)', self.data)
+        return db
+
+    def _same_result(self, source, read):
+        """Check that read(pt) is the same for source and the object rows"""
+        self.pt.rows = [CountedRow(*d) for d in self.data]
+        expected = read(self.pt)
+        self.pt.rows = source
+        eq_(read(self.pt), expected)
+
+    def test_XA_same_result(self):
+        source = SQLTable(self._db(), 'goals', batch=2)
+        result = lambda pt: [a for a in pt.result]
+        self._same_result(source, result)
+        self.pt.where = {'year':Range(2011),
+                         'region':In(['South', 'East', None])}
+        self._same_result(source, result)
+        self.pt.where = None
+        self.pt.xaxis = ['region', 'year']
+        self._same_result(source, lambda pt: pt.headers)
+
+    def test_XB_query(self):
+        spec = PivotSpec('year', [{'attr':'goals', 'label':'Goals',
+                                   'aggr':Mean}],
+                         where={'region':'North', 'year':Range(2011)})
+        eq_(SQLTable(None, 'goals').query(spec),
+            ('SELECT "year", SUM("goals"), COUNT("goals"), COUNT(*) '
+             'FROM "goals" WHERE "region" = ? AND '
+             '("year" IS NOT NULL AND "year" >= ?) GROUP BY "year"',
+             ['North', 2011]))
+
+    def test_XC_errors(self):
+        source = SQLTable(self._db(), 'goals')
+        assert not source.has_attr('points')
+        pt = PivotTable(rows=source, xaxis='year',
+                        yaxis=[{'attr':'goals', 'label':'Goals',
+                                'aggr':Min}])
+        eq_(list(pt.result)[1:], [["Goals", "3", "2", "1"]])
+        pt.yaxis = [{'attr':'points', 'label':'Points', 'aggr':Sum}]
+        assert_raises(PivotTableError, lambda: pt.result)
+
+class AsyncRows(object):
+    """An async iterable over rows, that yields to the event loop before every
+    row as an async driver would"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+        f = asyncio.get_event_loop().create_future()
+        try:
+            f.set_result(next(self.rows))
+        except StopIteration:
+            f.set_exception(StopAsyncIteration())
+        return f
+
+class TestPivot_Y(object):
+
+    pt = PivotTable()
+    pt.rows = [CountedRow(*d) for d in TestPivot_W.data]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    pt.yaxis_order = ['team']
+    pt.calculate_totals = True
+
+    def _run(self, coroutine):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def _collect(self, table, **kw):
+        from pivottable.aio import aiter_result
+        rows = aiter_result(table, **kw)
+        out = []
+        while True:
+            try:
+                out.append(self._run(rows.__anext__()))
+            except StopAsyncIteration:
+                return out
+
+    def test_YA_async_rows(self):
+        if sys.version_info<(3, 6):
+            raise SkipTest("asyncio support requires python 3.6")
+        from pivottable.aio import aggregate
+        pt = self.pt
+        expected = list(pt.result)
+        rows = [CountedRow(*d) for d in TestPivot_W.data]
+        self._run(aggregate(pt, AsyncRows(rows), chunksize=2))
+        eq_(list(pt.result), expected)
+        eq_(self._collect(pt, chunksize=2), expected)
+        eq_(self._collect(pt, raw=True)[-1], ['Total', 'Goals', 3, 6, 6, 15])
+        # the rows were consumed: a new definition cannot be aggregated
+        pt.xaxis = 'region'
+        assert_raises(PivotTableError, lambda: pt.result)
+
+    def test_YB_sync_rows(self):
+        if sys.version_info<(3, 6):
+            raise SkipTest("asyncio support requires python 3.6")
+        from pivottable.aio import aggregate, AsyncStream
+        pt = self.pt
+        pt.rows = AsyncStream([CountedRow(*d) for d in TestPivot_W.data])
+        pt.xaxis = "year"
+        assert_raises(PivotTableError, lambda: pt.result)
+        pt.where = {'region':'North'}
+        self._run(aggregate(pt))
+        eq_(list(pt.result)[1:], [['Boca', 'Goals', '3', None, '3'],
+                                  ['River', 'Goals', None, '2', '2'],
+                                  ['Total', 'Goals', '3', '2', '5']])
+
+class TestPivot_Z(object):
+
+    fields = ('region', 'team', 'year', 'goals')
+    pt = PivotTable()
+    pt.rows = [CountedRow(*d) for d in TestPivot_W.data]
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'region', 'label':'Region', 'aggr':GroupBy},
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    pt.yaxis_order = ['region', 'team']
+    pt.calculate_totals = True
+
+    def _expected(self):
+        """The result of the table over objects, read by attribute"""
+        self.pt.rows = [CountedRow(*d) for d in TestPivot_W.data]
+        return list(self.pt.result)
+
+    def test_ZA_dicts(self):
+        pt = self.pt
+        rows = [dict(zip(self.fields, d)) for d in TestPivot_W.data]
+        expected = self._expected()
+        pt.rows = rows
+        eq_(list(pt.result), expected)
+        pt.rows = iter(rows)
+        eq_(list(pt.result), expected)
+        pt.where = {'region':In(['South', 'East'])}
+        expected = self._expected()
+        pt.rows = rows
+        eq_(list(pt.result), expected)
+        rows = Rows(rows)
+        rows.add_index('region')
+        pt.rows = rows
+        eq_(list(pt.result), expected)
+        assert_raises(PivotTableError, setattr, pt, 'xaxis', 'month')
+
+    def test_ZB_tuples(self):
+        from collections import namedtuple
+        Goal = namedtuple('Goal', self.fields)
+        pt = self.pt
+        pt.where = None
+        expected = self._expected()
+        pt.rows = [Goal(*d) for d in TestPivot_W.data]
+        eq_(list(pt.result), expected)
+        # plain sequences are read by position
+        pt.rows = [list(d) for d in TestPivot_W.data]
+        pt.xaxis = 2
+        pt.yaxis = [
+            {'attr':0, 'label':'Region', 'aggr':GroupBy},
+            {'attr':1, 'label':'Team', 'aggr':GroupBy},
+            {'attr':3, 'label':'Goals', 'aggr':Sum}]
+        pt.yaxis_order = [0, 1]
+        result = list(pt.result)
+        eq_(result[1:], expected[1:])
+        eq_(result[0], ['0', '1', 'metric', '2010', '2011', '2012', 'Total'])
+        assert_raises(PivotTableError, setattr, pt, 'xaxis', 4)
+
+    def test_ZC_access(self):
+        spec = PivotSpec('year', [{'attr':'goals', 'label':'Goals',
+                                   'aggr':Sum}], access=self.fields)
+        eq_(spec.x_getter(TestPivot_W.data[0]), 2010)
+        eq_(Rows([{}]).access(), 'item')
+        eq_(Rows([CountedRow(*TestPivot_W.data[0])]).access(), 'attr')
+        rows = Stream(iter([(1, 2)]))
+        eq_(rows.access(), 'item')
+        eq_(list(rows), [(1, 2)])
+
+class TestPivot_AA(object):
+
+    data = [('South', 'River', 7, 2), ('North', 'Racing', 1, 3),
+            ('South', 'Boca', 12, 4), ('North', 'Boca', 7, 1),
+            ('East', 'Velez', 3, 5), ('South', 'River', 1, 6)]
+    rows = [CountedRow(*d) for d in data]
+    pt = PivotTable()
+    pt.rows = rows
+    pt.xaxis = "year"
+    pt.yaxis = [
+        {'attr':'region', 'label':'Region', 'aggr':GroupBy},
+        {'attr':'team', 'label':'Team', 'aggr':GroupBy},
+        {'attr':'goals', 'label':'Goals', 'aggr':Sum}]
+    pt.yaxis_order = ['region', 'team']
+
+    def test_AAA_insertion(self):
+        pt = self.pt
+        pt.xaxis_sort = False
+        pt.yaxis_sort = 'insertion'
+        pt.calculate_subtotals = True
+        eq_([a[:2] for a in pt.result], [
+            ['region', 'team'], ['South', 'River'], ['South', 'Boca'],
+            ['South', 'Subtotal'], ['North', 'Racing'], ['North', 'Boca'],
+            ['North', 'Subtotal'], ['East', 'Velez'], ['East', 'Subtotal']])
+        eq_(pt.headers[3:], [7, 1, 12, 3])
+        pt.rows.append(CountedRow('North', 'Lanus', 2, 1))
+        eq_([a[1] for a in pt.result][4:7], ['Racing', 'Boca', 'Lanus'])
+        eq_(pt.headers[3:], [7, 1, 12, 3, 2])
+
+    def test_AAB_sort_keys(self):
+        pt = self.pt
+        pt.rows = self.rows
+        pt.calculate_subtotals = False
+        # fiscal years start in July
+        fiscal = lambda month: (month - 7) % 12
+        pt.xaxis_sort = fiscal
+        pt.yaxis_sort = lambda k: (k[1], k[0])
+        eq_(pt.headers[3:], [7, 12, 1, 3])
+        # the teams of a region are kept together
+        eq_([a[:2] for a in pt.result][1:], [
+            ['North', 'Boca'], ['North', 'Racing'], ['South', 'Boca'],
+            ['South', 'River'], ['East', 'Velez']])
+        pt.xaxis_sort = lambda month: -month
+        eq_(pt.headers[3:], [12, 7, 3, 1])
+        pt.xaxis_sort = fiscal
+        eq_(pt.headers[3:], [7, 12, 1, 3])
+        pt.xaxis_sort = True
+        eq_(pt.headers[3:], [1, 3, 7, 12])
+
+    def test_AAC_errors(self):
+        self.pt.yaxis_sort = 'random'
+        assert_raises(PivotTableError, lambda: self.pt.result)
+        self.pt.yaxis_sort = False
+        self.pt.memory_limit = 1
+        assert_raises(PivotTableError, lambda: self.pt.result)
+        self.pt.memory_limit = None
+
+    def test_AAD_columnar(self):
+        if numpy is None:
+            raise SkipTest("numpy is not installed")
+        columns = dict(zip(['region', 'team', 'year', 'goals'],
+                           [numpy.array(c) for c in zip(*self.data)]))
+        for kw in ({'xaxis_sort':False, 'yaxis_sort':False},
+                   {'xaxis_sort':lambda month: -month},
+                   {'yaxis_sort':lambda k: k[1]}):
+            self.pt.xaxis_sort = True
+            self.pt.yaxis_sort = True
+            for k, v in kw.items():
+                setattr(self.pt, k, v)
+            self.pt.rows = self.rows
+            expected = list(self.pt.result)
+            self.pt.rows = columns
+            eq_(list(self.pt.result), expected)
+
+    def test_AAE_sort_keys_subtotals(self):
+        self.pt.rows = [CountedRow('North', 'b', 2010, 1),
+                        CountedRow('South', 'a', 2010, 2),
+                        CountedRow('North', 'c', 2010, 3),
+                        CountedRow('South', 'd', 2010, 4)]
+        self.pt.yaxis_sort = lambda k: k[1]
+        self.pt.calculate_subtotals = True
+        eq_([a[:2] + a[3:] for a in self.pt.result][1:], [
+            ['South', 'a', '2'], ['South', 'd', '4'],
+            ['South', 'Subtotal', '6'], ['North', 'b', '1'],
+            ['North', 'c', '3'], ['North', 'Subtotal', '4']])